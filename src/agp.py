@@ -0,0 +1,160 @@
+# agp.py
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import threading
+import numpy as np
+import pandas as pd
+from database import get_connection
+from data_loader import load_blood_sugar_data
+from utils import to_epoch
+
+DB_FILE = '../data/sample_blood_sugar_data.db'
+
+# Percentiles of the profile and the column each is returned in
+AGP_PERCENTILES = (5, 25, 50, 75, 95)
+AGP_COLUMNS = tuple(f"p{percentile}" for percentile in AGP_PERCENTILES)
+
+# Number of profiles kept by get_agp
+AGP_CACHE_SIZE = 256
+
+# Profiles by (db_file, patient_id, window end date, days, slot minutes), least recently used first
+_agp_cache = OrderedDict()
+_agp_lock = threading.Lock()
+
+
+def compute_agp(times, values, days, window_end, slot_minutes=15):
+    """
+    Calculates the Ambulatory Glucose Profile: glucose percentiles for each slot of the day.
+
+    Readings are averaged into a day-by-slot matrix with np.bincount and the percentiles of
+    every slot are taken across days with one np.nanpercentile call.
+
+    :param times: Epoch seconds of the readings.
+    :param values: Glucose values in mmol/L.
+    :param days: Number of days in the window.
+    :param window_end: Epoch seconds of the end of the window's last day.
+    :param slot_minutes: Length of each slot of the day in minutes; must divide a day.
+    :return: Data table with time (slot start, HH:MM), p5, p25, p50, p75, p95 and days (days with data).
+    """
+    if 1440 % slot_minutes:
+        raise ValueError(f"Slot length must divide a day, got {slot_minutes} minutes.")
+    slots = 1440 // slot_minutes
+    times = np.asarray(times, dtype='int64')
+    values = np.asarray(values, dtype='float64')
+
+    window_start = window_end - days * 86400
+    inside = (times >= window_start) & (times < window_end)
+    offsets = times[inside] - window_start
+    cells = (offsets // 86400) * slots + (offsets % 86400) // (slot_minutes * 60)
+
+    counts = np.bincount(cells, minlength=days * slots)
+    sums = np.bincount(cells, weights=values[inside], minlength=days * slots)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        matrix = (sums / counts).reshape(days, slots)
+
+    covered = counts.reshape(days, slots).astype(bool).sum(axis=0)
+    percentiles = np.full((len(AGP_PERCENTILES), slots), np.nan)
+    if covered.any():
+        percentiles[:, covered > 0] = np.nanpercentile(matrix[:, covered > 0], AGP_PERCENTILES, axis=0)
+
+    minutes = np.arange(slots) * slot_minutes
+    profile = pd.DataFrame(np.round(percentiles.T, 2), columns=AGP_COLUMNS)
+    profile.insert(0, 'time', [f"{minute // 60:02d}:{minute % 60:02d}" for minute in minutes])
+    profile['days'] = covered
+    return profile
+
+
+def window_bounds(window_end, days):
+    """
+    Aligns a window to whole days ending with the day of window_end.
+
+    :param window_end: Any time on the window's last day.
+    :param days: Number of days in the window.
+    :return: Tuple of (first day, last day) as dates.
+    """
+    last_day = pd.Timestamp(window_end).date()
+    return last_day - timedelta(days=days - 1), last_day
+
+
+def agp_from_readings(blood_sugar_data, window_end, days=14, slot_minutes=15):
+    """
+    Calculates the Ambulatory Glucose Profile of readings already in memory.
+
+    :param blood_sugar_data: Blood sugar data table with timestamp and glucose_value, for one patient;
+                             readings outside the window are ignored.
+    :param window_end: Any time on the window's last day.
+    :param days: Number of days in the window.
+    :param slot_minutes: Length of each slot of the day in minutes.
+    :return: Data table from compute_agp.
+    """
+    first_day, _ = window_bounds(window_end, days)
+    end = datetime.combine(first_day, datetime.min.time()) + timedelta(days=days)
+    return compute_agp(blood_sugar_data['timestamp'].to_numpy('datetime64[s]').astype('int64'),
+                       blood_sugar_data['glucose_value'].to_numpy(), days, to_epoch(end), slot_minutes)
+
+
+def window_version(db_file, patient_id, first_day, last_day):
+    """
+    Counts the readings logged in a window from the daily_stats table.
+
+    The count only grows as readings arrive, from this or any other process, so it
+    identifies the data a cached profile was computed from at the cost of at most one
+    indexed row per day.
+
+    :param db_file: Path to the database.
+    :param patient_id: Patient ID, or None for every patient.
+    :param first_day: First date of the window.
+    :param last_day: Last date of the window.
+    :return: Number of readings.
+    """
+    query = "SELECT COALESCE(SUM(reading_count), 0) FROM daily_stats WHERE day BETWEEN ? AND ?"
+    params = (first_day.isoformat(), last_day.isoformat())
+    if patient_id is not None:
+        query += " AND patient_id = ?"
+        params += (patient_id,)
+    return get_connection(db_file).execute(query, params).fetchone()[0]
+
+
+def get_agp(patient_id=None, window_end=None, days=14, slot_minutes=15, db_file=None):
+    """
+    Returns a patient's Ambulatory Glucose Profile, computing it only when not cached.
+
+    Profiles are cached by (patient, window end date, days, slot length) and recomputed
+    once new readings in the window have been logged.
+
+    :param patient_id: Patient ID, or None to combine every patient.
+    :param window_end: Any time on the window's last day, defaults to now.
+    :param days: Number of days in the window (e.g., 14, 30 or 90).
+    :param slot_minutes: Length of each slot of the day in minutes (e.g., 5 or 15).
+    :param db_file: Path to the database, defaults to DB_FILE.
+    :return: Data table from compute_agp.
+    """
+    db_file = db_file or DB_FILE
+    first_day, last_day = window_bounds(window_end or datetime.now(), days)
+    key = (db_file, patient_id, last_day, days, slot_minutes)
+    version = window_version(db_file, patient_id, first_day, last_day)
+
+    with _agp_lock:
+        cached = _agp_cache.get(key)
+        if cached is not None and cached[0] == version:
+            _agp_cache.move_to_end(key)
+            return cached[1].copy()
+
+    start = datetime.combine(first_day, datetime.min.time())
+    end = start + timedelta(days=days)
+    data = load_blood_sugar_data(db_file, start, end - timedelta(seconds=1),
+                                 columns=['timestamp', 'glucose_value'], patient_id=patient_id)
+    profile = agp_from_readings(data, last_day, days, slot_minutes)
+
+    with _agp_lock:
+        _agp_cache[key] = (version, profile)
+        _agp_cache.move_to_end(key)
+        while len(_agp_cache) > AGP_CACHE_SIZE:
+            _agp_cache.popitem(last=False)
+    return profile.copy()
+
+
+def clear_agp_cache():
+    """Drops every cached profile."""
+    with _agp_lock:
+        _agp_cache.clear()
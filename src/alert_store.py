@@ -0,0 +1,95 @@
+# alert_store.py
+import os
+import threading
+import time
+from database import fetch_all_data, transaction
+
+
+class AlertStateStore:
+    """
+    Persistent token-bucket rate limits for alerts, keyed by patient and alert type.
+
+    Each bucket holds up to `capacity` tokens and refills one token per cooldown period;
+    sending an alert takes a token. Buckets live in the alert_state table, so cooldowns
+    survive restarts, and every token is taken inside a write transaction, so several
+    monitor processes sharing one database never exceed the limit together.
+    """
+
+    def __init__(self, capacity=None):
+        """
+        :param capacity: Maximum alerts of one type that may be sent back to back,
+                         defaults to the ALERT_BURST environment variable or 1.
+        """
+        self.capacity = float(capacity or os.getenv("ALERT_BURST", 1))
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Reads every stored bucket once, e.g. at startup.
+
+        :return: Number of buckets loaded.
+        """
+        rows = fetch_all_data("SELECT patient_id, alert_type, tokens, updated_at FROM alert_state")
+        with self.lock:
+            self.buckets = {(patient_id, alert_type): (tokens, updated_at)
+                            for patient_id, alert_type, tokens, updated_at in rows}
+        return len(rows)
+
+    def try_acquire(self, patient_id, alert_type, cooldown_minutes, now=None):
+        """
+        Takes a token for an alert if one is available.
+
+        :param patient_id: LibreLinkUp patient ID.
+        :param alert_type: Alert type key (e.g., "low").
+        :param cooldown_minutes: Minutes needed to refill one token.
+        :param now: Current epoch time in seconds, defaults to time.time().
+        :return: True if the alert may be sent.
+        """
+        now = time.time() if now is None else now
+        with transaction() as con:
+            # Read inside the write transaction so other processes' tokens are respected
+            row = con.execute("SELECT tokens, updated_at FROM alert_state WHERE patient_id = ? AND alert_type = ?",
+                              (patient_id, alert_type)).fetchone()
+            tokens, updated_at = row if row else (self.capacity, now)
+            tokens = min(self.capacity, tokens + max(now - updated_at, 0) / (cooldown_minutes * 60))
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            con.execute("""
+            INSERT INTO alert_state(patient_id, alert_type, tokens, updated_at, last_sent)
+            VALUES (?,?,?,?,?)
+            ON CONFLICT(patient_id, alert_type) DO UPDATE SET
+                tokens = excluded.tokens,
+                updated_at = excluded.updated_at,
+                last_sent = COALESCE(excluded.last_sent, last_sent)
+            """, (patient_id, alert_type, tokens, now, now if allowed else None))
+
+        with self.lock:
+            self.buckets[(patient_id, alert_type)] = (tokens, now)
+        return allowed
+
+    def reset(self, patient_id, alert_types, now=None):
+        """
+        Refills buckets of a patient, e.g. once glucose is back in range.
+
+        Only writes when one of the buckets is known to be below capacity, so a stable
+        patient costs no database work.
+
+        :param patient_id: LibreLinkUp patient ID.
+        :param alert_types: Alert type keys whose buckets are refilled.
+        :param now: Current epoch time in seconds, defaults to time.time().
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            depleted = [key for key, (tokens, _) in self.buckets.items()
+                        if key[0] == patient_id and key[1] in alert_types and tokens < self.capacity]
+            if not depleted:
+                return
+            for key in depleted:
+                self.buckets[key] = (self.capacity, now)
+
+        with transaction() as con:
+            con.executemany("UPDATE alert_state SET tokens = ?, updated_at = ? WHERE patient_id = ? AND alert_type = ?",
+                            [(self.capacity, now, patient_id, alert_type) for _, alert_type in depleted])
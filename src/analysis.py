@@ -1,10 +1,227 @@
-from dotenv import load_dotenv
+from dataclasses import dataclass
+import json
 import os
+import signal
+import threading
+import time
 
 
+# Environment file the monitor reads its settings from; variables set in the process environment
+# take precedence. Read when the thresholds are first loaded, not at import, so importing stays cheap
+ENV_FILE = '../login.env'
 
+# Thresholds used when a variable is not set, in mmol/L
+DEFAULT_THRESHOLDS = {
+    'LOW_THRESHOLD': 3.9,
+    'HIGH_THRESHOLD': 9.0,
+    'EXTREMELY_LOW_THRESHOLD': 2.8,
+    'EXTREMELY_HIGH_THRESHOLD': 20.0,
+}
+
+# Seconds between checks of THRESHOLDS_FILE for changes
+THRESHOLDS_FILE_CHECK_INTERVAL = 5
+
+# Glucose level labels returned by classify_readings, from lowest to highest
+LEVELS = ("EXTREMELY low", "Low", "Normal", "High", "EXTREMELY high")
+
+
+@dataclass(frozen=True)
+class ThresholdProfile:
+    """
+    Validated glucose thresholds in mmol/L.
+    """
+    low: float
+    high: float
+    extremely_low: float
+    extremely_high: float
+
+    def __post_init__(self):
+        if not self.extremely_low <= self.low < self.high <= self.extremely_high:
+            raise ValueError(
+                "Thresholds must satisfy EXTREMELY_LOW <= LOW < HIGH <= EXTREMELY_HIGH, got "
+                f"{self.extremely_low}, {self.low}, {self.high}, {self.extremely_high}.")
+
+    @classmethod
+    def from_mapping(cls, values, defaults=None):
+        """
+        Builds a profile from threshold variables (e.g., LOW_THRESHOLD).
+
+        :param values: Mapping of threshold variable names to values.
+        :param defaults: Mapping used for variables missing from values.
+        :return: ThresholdProfile instance.
+        """
+        defaults = defaults or DEFAULT_THRESHOLDS
+
+        def read(name):
+            value = values.get(name)
+            try:
+                return float(defaults[name] if value is None else value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid value for {name}: {value}")
+
+        return cls(read('LOW_THRESHOLD'), read('HIGH_THRESHOLD'),
+                   read('EXTREMELY_LOW_THRESHOLD'), read('EXTREMELY_HIGH_THRESHOLD'))
+
+    def as_mapping(self):
+        """
+        :return: Dictionary of threshold variable names to values.
+        """
+        return {
+            'LOW_THRESHOLD': self.low,
+            'HIGH_THRESHOLD': self.high,
+            'EXTREMELY_LOW_THRESHOLD': self.extremely_low,
+            'EXTREMELY_HIGH_THRESHOLD': self.extremely_high,
+        }
+
+
+# Parsed threshold profiles, loaded once and replaced on reload
+_default_profile = None
+_patient_profiles = {}
+_thresholds_file = None
+_thresholds_file_mtime = None
+_thresholds_file_checked = 0.0
+_profiles_lock = threading.Lock()
+
+
+def reload_thresholds():
+    """
+    Re-reads the thresholds from the environment and the optional THRESHOLDS_FILE.
+
+    Threshold variables set in the process environment take precedence over ENV_FILE,
+    which is read without changing os.environ.
+
+    THRESHOLDS_FILE is a JSON file with a "default" object and a "patients" object of
+    per-patient overrides, both keyed by threshold variable name. Invalid settings
+    leave the current profiles in place.
+
+    :return: The default ThresholdProfile.
+    """
+    global _default_profile, _patient_profiles, _thresholds_file, _thresholds_file_mtime, _thresholds_file_checked
+    from dotenv import dotenv_values
+
+    environment = {**dotenv_values(ENV_FILE), **os.environ} if os.path.exists(ENV_FILE) else os.environ
+    default_profile = ThresholdProfile.from_mapping(environment)
+    patient_profiles = {}
+
+    thresholds_file = os.getenv('THRESHOLDS_FILE')
+    mtime = None
+    if thresholds_file and os.path.exists(thresholds_file):
+        mtime = os.path.getmtime(thresholds_file)
+        with open(thresholds_file) as file:
+            settings = json.load(file)
+        default_profile = ThresholdProfile.from_mapping(settings.get('default', {}), default_profile.as_mapping())
+        for patient_id, values in settings.get('patients', {}).items():
+            patient_profiles[patient_id] = ThresholdProfile.from_mapping(values, default_profile.as_mapping())
+
+    with _profiles_lock:
+        _default_profile = default_profile
+        _patient_profiles = patient_profiles
+        _thresholds_file = thresholds_file
+        _thresholds_file_mtime = mtime
+        _thresholds_file_checked = time.monotonic()
+    return default_profile
+
+
+def _thresholds_file_changed():
+    """
+    Checks, at most every THRESHOLDS_FILE_CHECK_INTERVAL seconds, whether THRESHOLDS_FILE changed.
+
+    :return: True if the file was modified since it was last loaded.
+    """
+    global _thresholds_file_checked
+    if not _thresholds_file:
+        return False
+    now = time.monotonic()
+    if now - _thresholds_file_checked < THRESHOLDS_FILE_CHECK_INTERVAL:
+        return False
+    _thresholds_file_checked = now
+    mtime = os.path.getmtime(_thresholds_file) if os.path.exists(_thresholds_file) else None
+    return mtime != _thresholds_file_mtime
+
+
+def get_thresholds(patient_id=None):
+    """
+    Returns the cached threshold profile, loading it on first use.
+
+    :param patient_id: Patient whose overrides should apply, or None for the default profile.
+    :return: ThresholdProfile instance.
+    """
+    if _default_profile is None or _thresholds_file_changed():
+        try:
+            reload_thresholds()
+        except (OSError, ValueError) as e:
+            if _default_profile is None:
+                raise
+            print("Error reloading thresholds, keeping current values: ", e)
+    return _patient_profiles.get(patient_id, _default_profile)
+
+
+def set_patient_thresholds(patient_id, profile):
+    """
+    Sets the threshold profile of one patient until the next reload.
+
+    :param patient_id: LibreLinkUp patient ID.
+    :param profile: ThresholdProfile to use for the patient.
+    """
+    get_thresholds()
+    with _profiles_lock:
+        _patient_profiles[patient_id] = profile
+
+
+def install_reload_handler():
+    """
+    Reloads the thresholds when the process receives SIGHUP (where supported).
+
+    Invalid settings are reported and the current profiles kept, so a bad edit never stops the monitor.
+    """
+    def reload(signum, frame):
+        try:
+            reload_thresholds()
+        except (OSError, ValueError) as e:
+            print("Error reloading thresholds, keeping current values: ", e)
+
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, reload)
+
+
+def classify_level(value, thresholds=None):
+    """
+    Labels a single glucose reading with its level without loading NumPy.
+
+    :param value: Glucose value in mmol/L.
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
+    :return: Label from LEVELS.
+    """
+    thresholds = thresholds or get_thresholds()
+    if value < thresholds.extremely_low:
+        return LEVELS[0]
+    if value < thresholds.low:
+        return LEVELS[1]
+    if value > thresholds.extremely_high:
+        return LEVELS[4]
+    if value > thresholds.high:
+        return LEVELS[3]
+    return LEVELS[2]
+
+
+def classify_readings(values, thresholds=None):
+    """
+    Labels an array of glucose readings with their level in one vectorised call.
+
+    :param values: Sequence or array of glucose values in mmol/L.
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
+    :return: NumPy array of labels from LEVELS.
+    """
+    import numpy as np
+
+    thresholds = thresholds or get_thresholds()
+    values = np.asarray(values, dtype=float)
+    return np.select(
+        [values < thresholds.extremely_low, values < thresholds.low,
+         values > thresholds.extremely_high, values > thresholds.high],
+        [LEVELS[0], LEVELS[1], LEVELS[4], LEVELS[3]],
+        default=LEVELS[2])
 
-load_dotenv(dotenv_path='../login_example.env')
 
 def retrieve_value(data,key):
     """
@@ -19,79 +236,79 @@ def retrieve_value(data,key):
     except KeyError:
         raise KeyError(f"Key '{key}' not found in the provided data.")
 
-def is_low_blood_sugar(glucose_data):
+def is_low_blood_sugar(glucose_data, thresholds=None):
     '''
     Checks if the blood sugar level is below the low threshold.
 
     :param glucose_data: Dictionary containing glucose information.
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
     :return: Boolean indicating if the blood sugar level is low.
     '''
     try:
 
         blood_sugar = retrieve_value(glucose_data,'Value')
-        low_threshold = float(os.getenv('LOW_THRESHOLD'))
-        return blood_sugar < low_threshold
+        return blood_sugar < (thresholds or get_thresholds()).low
     except (TypeError, ValueError) as e:
         raise ValueError("Error determining low blood sugar: ", e)
 
-def is_high_blood_sugar(glucose_data):
+def is_high_blood_sugar(glucose_data, thresholds=None):
     '''
     Checks if the blood sugar level is above the high threshold.
 
     :param glucose_data: Dictionary containing glucose information.
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
     :return: Boolean indicating if the blood sugar level is high.
     '''
 
     try:
         blood_sugar = retrieve_value(glucose_data, 'Value')
-        high_threshold = float(os.getenv('HIGH_THRESHOLD'))
-        return blood_sugar > high_threshold
+        return blood_sugar > (thresholds or get_thresholds()).high
     except (TypeError, ValueError) as e:
         raise ValueError("Error determining high blood sugar: ", e)
 
 
 
-def is_extremely_low(glucose_data):
+def is_extremely_low(glucose_data, thresholds=None):
     '''
     Checks if the blood sugar level is below the extremely low threshold.
 
     :param glucose_data: Dictionary containing glucose information.
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
     :return: Boolean indicating if the blood sugar level is extremely low.
     '''
 
     try:
         blood_sugar = retrieve_value(glucose_data, 'Value')
-        extremely_low_threshold = float(os.getenv('EXTREMELY_LOW_THRESHOLD'))
-        return blood_sugar < extremely_low_threshold
+        return blood_sugar < (thresholds or get_thresholds()).extremely_low
     except (TypeError, ValueError) as e :
         raise ValueError("Error determining extremely low blood sugar: ",e)
 
-def is_extremely_high(glucose_data):
+def is_extremely_high(glucose_data, thresholds=None):
     '''
     Checks if the blood sugar level is below the extremely low threshold.
 
     :param glucose_data: Dictionary containing glucose information.
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
     :return: Boolean indicating if the blood sugar level is extremely high.
     '''
 
     try:
         blood_sugar = retrieve_value(glucose_data,'Value')
-        extremely_high_threshold = float(os.getenv('EXTREMELY_HIGH_THRESHOLD'))
-        return blood_sugar > extremely_high_threshold
+        return blood_sugar > (thresholds or get_thresholds()).extremely_high
     except (TypeError, ValueError) as e:
         raise ValueError("Error determining extremely high blood sugar: ", e)
 
-def is_normal_level(glucose_data):
+def is_normal_level(glucose_data, thresholds=None):
     """
     Determines if the blood sugar level is within normal range.
 
     :param glucose_data: Dictionary containing glucose information.
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
     :return: Boolen indicating if blood sugar level is normal
     """
     try:
         blood_sugar = retrieve_value(glucose_data,'Value')
-        low_threshold = float(os.getenv('LOW_THRESHOLD'))
-        high_threshold = float(os.getenv('HIGH_THRESHOLD'))
-        return low_threshold <= blood_sugar <= high_threshold
+        thresholds = thresholds or get_thresholds()
+        return thresholds.low <= blood_sugar <= thresholds.high
     except (TypeError, ValueError) as e:
         raise ValueError("Error determining normal blood sugar level: ", e)
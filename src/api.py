@@ -1,6 +1,11 @@
 # api.py
+import threading
+import time
 import requests
-from config import LOGIN_ENDPOINT, HEADERS,CONNECTIONS_ENDPOINT,CGM_DATA_ENDPOINT
+from requests.adapters import HTTPAdapter
+from config import LOGIN_ENDPOINT, HEADERS,CONNECTIONS_ENDPOINT,CGM_DATA_ENDPOINT, \
+    TOKEN_EXPIRY_MARGIN, HTTP_POOL_SIZE, HTTP_TIMEOUT
+from instrumentation import timed
 
 
 def login(email, password):
@@ -70,4 +75,167 @@ def get_cgm_data(token, patient_id):
     except requests.exceptions.RequestException as e:
         raise Exception(f"Failed to get CGM data. Error: {str(e)}") from e
     except KeyError:
-        raise Exception("Missing CGM data.")
\ No newline at end of file
+        raise Exception("Missing CGM data.")
+
+
+class LibreLinkUpSession:
+    """
+    Authenticated LibreLinkUp client that reuses one pooled HTTP session.
+
+    The JWT from ``authTicket`` is cached until shortly before it expires and the
+    patient ID is cached after the first lookup, so a steady-state poll costs a
+    single keep-alive request. A 401 response triggers one fresh login and retry.
+    CGM data is fetched conditionally when the server sends an ETag or Last-Modified
+    validator, so an unchanged payload costs a body-less 304 response.
+    """
+
+    def __init__(self, email, password, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT):
+        """
+        :param email: User's LibreLinkUp email.
+        :param password: User's LibreLinkUp password.
+        :param pool_size: Maximum number of pooled keep-alive connections.
+        :param timeout: Timeout in seconds for each HTTP request.
+        """
+        self.email = email
+        self.password = password
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(HEADERS)
+
+        self._token = None
+        self._token_expires = 0.0
+        self._patient_id = None
+        self._validators = {}  # URL to conditional request headers from its last response
+        self._lock = threading.Lock()
+
+    def _login(self):
+        """
+        Logs in and caches the JWT token with its expiry time.
+
+        :returns: JWT token
+        """
+        payload = {"email": self.email, "password": self.password}
+        with timed("login"):
+            try:
+                response = self.session.post(LOGIN_ENDPOINT, json=payload, timeout=self.timeout)
+                response.raise_for_status()
+                auth_ticket = response.json()["data"]["authTicket"]
+                self._token = auth_ticket["token"]
+                # Tickets without an expiry are treated as valid until the next 401
+                self._token_expires = float(auth_ticket.get("expires") or float("inf"))
+                return self._token
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"Login failed. Error: {str(e)}") from e
+            except (KeyError, TypeError):
+                raise Exception("Missing token in response.")
+
+    def get_token(self):
+        """
+        Returns a valid JWT token, logging in only if none is cached or it is about to expire.
+
+        :returns: JWT token
+        """
+        with self._lock:
+            if self._token is None or time.time() >= self._token_expires - TOKEN_EXPIRY_MARGIN:
+                self._login()
+            return self._token
+
+    def invalidate_token(self, token):
+        """
+        Drops the cached token if it is still the one that was rejected.
+
+        :param token: Token that received a 401 response.
+        """
+        with self._lock:
+            if self._token == token:
+                self._token = None
+                self._token_expires = 0.0
+
+    def _get(self, url, conditional=False):
+        """
+        Sends an authenticated GET request, logging in again once on a 401.
+
+        :param url: URL to request.
+        :param conditional: Send the validators of the URL's last response, so an unchanged
+                            resource is answered with a 304.
+        :returns: Response object.
+        """
+        headers = dict(self._validators.get(url, {})) if conditional else {}
+        token = self.get_token()
+        response = self.session.get(url, headers={**headers, 'authorization': f'Bearer {token}'},
+                                    timeout=self.timeout)
+        if response.status_code == 401:
+            self.invalidate_token(token)
+            token = self.get_token()
+            response = self.session.get(url, headers={**headers, 'authorization': f'Bearer {token}'},
+                                        timeout=self.timeout)
+        response.raise_for_status()
+
+        if conditional and response.status_code != 304:
+            validators = {}
+            if response.headers.get('ETag'):
+                validators['if-none-match'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                validators['if-modified-since'] = response.headers['Last-Modified']
+            self._validators[url] = validators
+        return response
+
+    def get_connections(self):
+        """
+        Fetches every connection (followed patient) of the user.
+
+        :returns: List of connection dictionaries.
+        """
+        with timed("connections"):
+            try:
+                connections = self._get(CONNECTIONS_ENDPOINT).json()["data"]
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"Failed to fetch connections. Error: {str(e)}") from e
+            except KeyError:
+                raise Exception("Missing connections data.")
+            if not connections:
+                raise Exception("No connections found!")
+            return connections
+
+    def get_patient_id(self):
+        """
+        Get the patient ID associated with the user, cached after the first lookup.
+
+        :returns: Patient ID.
+        """
+        if self._patient_id is None:
+            try:
+                self._patient_id = self.get_connections()[0]["patientId"]
+            except KeyError:
+                raise Exception("Missing patient ID.")
+        return self._patient_id
+
+    def get_cgm_data(self, patient_id=None, conditional=False):
+        """
+        Fetches CGM data for the specified patient ID.
+
+        :param patient_id: Patient ID, defaults to the user's first connection.
+        :param conditional: Return None instead of the payload if it is unchanged since the last fetch.
+        :returns: a dictionary containing CGM data, or None if conditional and unchanged.
+        """
+        if patient_id is None:
+            patient_id = self.get_patient_id()
+        url = CGM_DATA_ENDPOINT.format(patientId=patient_id)
+
+        with timed("graph_fetch", patient_id):
+            try:
+                response = self._get(url, conditional)
+                if response.status_code == 304:
+                    return None
+                return response.json()["data"]
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"Failed to get CGM data. Error: {str(e)}") from e
+            except KeyError:
+                raise Exception("Missing CGM data.")
+
+    def close(self):
+        """Closes the pooled HTTP connections."""
+        self.session.close()
@@ -0,0 +1,325 @@
+# cli.py
+import argparse
+from datetime import datetime
+import json
+import math
+import os
+import sys
+from analysis import get_thresholds
+from utils import resolve_time_range
+
+# pandas and the analytics modules are imported by the subcommands that use them,
+# so log-insulin starts without loading them
+
+DB_FILE = '../data/sample_blood_sugar_data.db'
+
+# Summaries a report can include: report name to data_analysis.summarize grouping key
+SUMMARIES = {
+    'daily': 'date',
+    'time-period': 'time_period',
+    'hourly': 'hour',
+    'weekday': 'weekday',
+}
+REPORTS = tuple(SUMMARIES) + ('metrics', 'agp', 'glucose')
+DEFAULT_REPORTS = ('daily', 'time-period', 'metrics', 'agp', 'glucose')
+
+# Table formats and image formats a report can be written in
+TABLE_FORMATS = ('json', 'csv')
+IMAGE_FORMATS = ('png', 'svg')
+
+
+def add_time_range_arguments(parser):
+    """
+    Adds the --from, --to and --days options to a subcommand.
+
+    :param parser: Subcommand argument parser.
+    """
+    parser.add_argument('--from', dest='start', help="Earliest time (e.g., 2024-12-01 or '2024-12-01 06:00')")
+    parser.add_argument('--to', dest='end', help="Latest time, defaults to now")
+    parser.add_argument('--days', type=int, help="Days before --to to start from when --from is not given")
+
+
+def build_parser():
+    """
+    Builds the command-line parser.
+
+    :return: ArgumentParser with the report, patients and log-insulin subcommands.
+    """
+    parser = argparse.ArgumentParser(description="DiaComp analysis and reporting without interactive menus.")
+    parser.add_argument('--db', default=DB_FILE, help="SQLite database (default: %(default)s)")
+    parser.add_argument('--export-dir', help="Read readings from this Parquet export instead of the database")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    report = subcommands.add_parser('report', help="Write summaries, metrics and plots for one or more patients")
+    add_time_range_arguments(report)
+    report.add_argument('--patient', action='append',
+                        help="Patient ID, repeatable; 'all' for each patient separately (default: every reading combined)")
+    report.add_argument('--report', action='append', choices=REPORTS,
+                        help=f"Report to produce, repeatable (default: {', '.join(DEFAULT_REPORTS)})")
+    report.add_argument('--format', action='append', choices=TABLE_FORMATS + IMAGE_FORMATS,
+                        help="Output format, repeatable (default: json and png)")
+    report.add_argument('--output-dir', default='reports', help="Directory for report files (default: %(default)s)")
+    report.add_argument('--agp-days', type=int, default=14, help="Days in the AGP window (default: %(default)s)")
+    report.add_argument('--agp-slot', type=int, default=15, help="Minutes per AGP slot (default: %(default)s)")
+
+    patients = subcommands.add_parser('patients', help="List patients with readings in a time range")
+    add_time_range_arguments(patients)
+
+    log_insulin = subcommands.add_parser('log-insulin', help="Log an insulin dose")
+    log_insulin.add_argument('--time', help="Time of the dose, defaults to now")
+    log_insulin.add_argument('--units', type=float, required=True, help="Insulin units")
+    log_insulin.add_argument('--type', dest='dosage_type', help="Insulin type (e.g., rapid-acting)")
+    log_insulin.add_argument('--entry', dest='entry_type', help="Entry type (e.g., Meal or Correction)")
+    log_insulin.add_argument('--carbs', type=float, help="Carbs in grams")
+    return parser
+
+
+def load_readings(args, start, end, patient_id=None):
+    """
+    Loads the readings of a time range once for every report of the run.
+
+    :param args: Parsed arguments.
+    :param start: Earliest time, or None for no lower bound.
+    :param end: Latest time.
+    :param patient_id: Only load this patient's readings.
+    :return: Blood sugar data table.
+    """
+    columns = ['patient_id', 'timestamp', 'glucose_value', 'alert_type']
+    if args.export_dir:
+        from columnar import load_blood_sugar_export
+        return load_blood_sugar_export(args.export_dir, start, end, columns, patient_id)
+    from data_loader import load_blood_sugar_data
+    return load_blood_sugar_data(args.db, start, end, columns, patient_id)
+
+
+def agp_start(args, end):
+    """
+    Returns the start of the AGP window of a report.
+
+    :param args: Parsed arguments.
+    :param end: End of the time range, used as the AGP window end.
+    :return: Midnight starting the window's first day.
+    """
+    from agp import window_bounds
+    first_day, _ = window_bounds(end, args.agp_days)
+    return datetime.combine(first_day, datetime.min.time())
+
+
+def build_report(readings, patient_id, reports, args, start, end):
+    """
+    Calculates the requested tables for one patient from readings already loaded.
+
+    :param readings: The patient's blood sugar data table, covering the time range and the AGP window.
+    :param patient_id: Patient ID, or None for every reading combined.
+    :param reports: Names of the reports to produce.
+    :param args: Parsed arguments.
+    :param start: Start of the time range of the summaries and metrics, or None for no lower bound.
+    :param end: End of the time range, used as the AGP window end.
+    :return: Dictionary of report name to data table or, for metrics, dictionary.
+    """
+    from data_analysis import summarize
+    from metrics import glycaemic_metrics
+
+    thresholds = get_thresholds(patient_id)
+    in_range = readings if start is None else readings[readings['timestamp'] >= start]
+    tables = {}
+    for name in reports:
+        if name in SUMMARIES:
+            tables[name] = summarize(in_range, SUMMARIES[name], thresholds)
+        elif name == 'metrics':
+            tables[name] = glycaemic_metrics(in_range, thresholds)
+        elif name == 'agp':
+            from agp import agp_from_readings
+            tables[name] = agp_from_readings(readings, end, args.agp_days, args.agp_slot)
+    return tables
+
+
+def json_value(value):
+    """
+    Converts a table value to a strict JSON value.
+
+    :param value: Value from a report table.
+    :return: The value as a plain Python type, with NaN and infinity as None.
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def json_records(table):
+    """
+    Converts a report table to JSON-ready records.
+
+    :param table: Data table, or dictionary of metric name to value.
+    :return: Dictionary or list of dictionaries with strict JSON values.
+    """
+    if isinstance(table, dict):
+        return {name: json_value(value) for name, value in table.items()}
+    return [{name: json_value(value) for name, value in record.items()}
+            for record in table.to_dict(orient='records')]
+
+
+def metrics_frame(metrics):
+    """
+    Turns a metrics dictionary into a two-column table for CSV output.
+
+    :param metrics: Dictionary of metric name to value.
+    :return: Data table with metric and value columns.
+    """
+    import pandas as pd
+    return pd.DataFrame({'metric': list(metrics), 'value': pd.Series(list(metrics.values()), dtype=object)})
+
+
+def write_report(directory, readings, tables, formats, plot_glucose=True):
+    """
+    Writes one patient's report files.
+
+    :param directory: Directory for the patient's files.
+    :param readings: The patient's blood sugar data table, used for the glucose plot.
+    :param tables: Result of build_report.
+    :param formats: Output formats.
+    :param plot_glucose: Whether to plot the readings themselves.
+    :return: List of written file paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    written = []
+
+    if 'json' in formats:
+        path = os.path.join(directory, 'report.json')
+        document = {name: json_records(table) for name, table in tables.items()}
+        with open(path, 'w') as file:
+            # Empty AGP slots and undefined metrics are written as null; NaN would not be valid JSON
+            json.dump(document, file, indent=2, default=str, allow_nan=False)
+        written.append(path)
+
+    if 'csv' in formats:
+        for name, table in tables.items():
+            path = os.path.join(directory, f"{name}.csv")
+            if isinstance(table, dict):
+                table = metrics_frame(table)
+            table.to_csv(path, index=False)
+            written.append(path)
+
+    images = [image_format for image_format in IMAGE_FORMATS if image_format in formats]
+    if images:
+        import data_visualization as plots
+        charts = {
+            'glucose': lambda output: plots.plot_blood_sugar_data(readings, output),
+            'daily': lambda output: plots.generate_daily_summary(tables['daily'], output),
+            'time-period': lambda output: plots.generate_daily_time_summary(tables['time-period'], output),
+            'agp': lambda output: plots.generate_agp_plot(tables['agp'], output),
+        }
+        for name, draw in charts.items():
+            if name not in tables and not (name == 'glucose' and plot_glucose):
+                continue
+            for image_format in images:
+                path = os.path.join(directory, f"{name}.{image_format}")
+                draw(path)
+                if os.path.exists(path):
+                    written.append(path)
+    return written
+
+
+def run_report(args):
+    """
+    Produces every requested report for every requested patient from a single data load.
+
+    :param args: Parsed arguments.
+    :return: Exit status.
+    """
+    start, end = resolve_time_range(args.start, args.end, args.days)
+    reports = args.report or DEFAULT_REPORTS
+    formats = args.format or ('json', 'png')
+
+    patients = args.patient or [None]
+    single = len(patients) == 1 and patients[0] not in (None, 'all')
+    # One load covers the time range and the AGP window
+    load_start = start
+    if 'agp' in reports and start is not None:
+        load_start = min(start, agp_start(args, end))
+    readings = load_readings(args, load_start, end, patients[0] if single else None)
+    if readings.empty:
+        print("No data available for the selected time range.", file=sys.stderr)
+        return 1
+
+    if 'all' in patients:
+        patients = [patient for patient in readings['patient_id'].dropna().unique()]
+        if readings['patient_id'].isna().any():
+            patients.append(None)
+
+    for patient_id in patients:
+        if patient_id is None and len(patients) == 1:
+            patient_readings = readings
+        elif patient_id is None:
+            patient_readings = readings[readings['patient_id'].isna()]
+        else:
+            patient_readings = readings[readings['patient_id'] == patient_id]
+        if patient_readings.empty:
+            print(f"No data for patient {patient_id}.", file=sys.stderr)
+            continue
+
+        tables = build_report(patient_readings, patient_id, reports, args, start, end)
+        directory = os.path.join(args.output_dir, str(patient_id or 'all'))
+        if load_start != start:
+            patient_readings = patient_readings[patient_readings['timestamp'] >= start]
+        written = write_report(directory, patient_readings, tables, formats, 'glucose' in reports)
+        print(f"Wrote {len(written)} files for {patient_id or 'all readings'} to {directory}")
+    return 0
+
+
+def run_patients(args):
+    """
+    Prints the patients with readings in a time range and their reading counts.
+
+    :param args: Parsed arguments.
+    :return: Exit status.
+    """
+    start, end = resolve_time_range(args.start, args.end, args.days)
+    readings = load_readings(args, start, end)
+    counts = readings['patient_id'].astype(object).fillna('').value_counts(sort=False).sort_index()
+    for patient_id, count in counts.items():
+        print(f"{patient_id or '(no patient)'}\t{count}")
+    return 0
+
+
+def run_log_insulin(args):
+    """
+    Logs an insulin dose from the command-line options.
+
+    :param args: Parsed arguments.
+    :return: Exit status.
+    """
+    import database
+    from log_insulin import record_insulin_dose
+
+    database.DB_FILE = args.db
+    record_insulin_dose(args.time or datetime.now(), args.units, args.dosage_type, args.entry_type, args.carbs)
+    return 0
+
+
+COMMANDS = {
+    'report': run_report,
+    'patients': run_patients,
+    'log-insulin': run_log_insulin,
+}
+
+
+def main(argv=None):
+    """
+    Runs a subcommand from the command line.
+
+    :param argv: Arguments, defaults to sys.argv[1:].
+    :return: Exit status.
+    """
+    args = build_parser().parse_args(argv)
+    try:
+        return COMMANDS[args.command](args)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+# columnar.py
+import os
+import sys
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+from database import get_connection
+from data_loader import resolve_columns, compact_blood_sugar_frame, CHUNK_SIZE
+from utils import to_epoch, from_epoch
+
+DB_FILE = '../data/sample_blood_sugar_data.db'
+EXPORT_DIR = '../data/export'
+
+# File formats by name: Parquet files or Arrow IPC (Feather v2) files
+FORMATS = {'parquet': 'parquet', 'ipc': 'ipc', 'arrow': 'ipc'}
+
+# Files are laid out as <table>/patient_id=<id>/month=<YYYY-MM>/, readings without a patient
+# in the __HIVE_DEFAULT_PARTITION__ directory
+PARTITIONING = ds.partitioning(pa.schema([('patient_id', pa.string()), ('month', pa.string())]), flavor='hive')
+
+# Query and Arrow schema of each exported table; timestamps stay epoch seconds as in SQLite
+EXPORT_TABLES = {
+    'blood_sugar_log': ("""
+        SELECT id, timestamp, glucose_value, alert_type, log_type, notes, patient_id,
+               strftime('%Y-%m', timestamp, 'unixepoch') AS month
+        FROM blood_sugar_log ORDER BY timestamp""", pa.schema([
+        ('id', pa.int64()),
+        ('timestamp', pa.int64()),
+        ('glucose_value', pa.float32()),
+        ('alert_type', pa.dictionary(pa.int8(), pa.string())),
+        ('log_type', pa.dictionary(pa.int8(), pa.string())),
+        ('notes', pa.string()),
+        ('patient_id', pa.string()),
+        ('month', pa.string()),
+    ])),
+    # Doses belong to the patient of their related reading
+    'insulin_doses': ("""
+        SELECT d.id, d.timestamp, d.dosage_amount, d.dosage_type, d.entry_type, d.carbs, d.related_log_id,
+               b.patient_id, strftime('%Y-%m', d.timestamp, 'unixepoch') AS month
+        FROM insulin_doses AS d LEFT JOIN blood_sugar_log AS b ON b.id = d.related_log_id
+        ORDER BY d.timestamp""", pa.schema([
+        ('id', pa.int64()),
+        ('timestamp', pa.int64()),
+        ('dosage_amount', pa.float32()),
+        ('dosage_type', pa.dictionary(pa.int8(), pa.string())),
+        ('entry_type', pa.dictionary(pa.int8(), pa.string())),
+        ('carbs', pa.float32()),
+        ('related_log_id', pa.int64()),
+        ('patient_id', pa.string()),
+        ('month', pa.string()),
+    ])),
+}
+
+
+def get_format(file_format):
+    """
+    Resolves a file format name.
+
+    :param file_format: 'parquet', or 'ipc'/'arrow' for Arrow IPC files.
+    :return: pyarrow dataset format name.
+    """
+    try:
+        return FORMATS[file_format]
+    except KeyError:
+        raise ValueError(f"Unknown export format '{file_format}'. Choose from: {', '.join(FORMATS)}")
+
+
+def iter_record_batches(table, db_file=None, chunksize=CHUNK_SIZE):
+    """
+    Reads a table from SQLite as Arrow record batches, one chunk of rows at a time.
+
+    :param table: Table name, one of EXPORT_TABLES.
+    :param db_file: Path to the SQLite database, defaults to DB_FILE.
+    :param chunksize: Number of rows per batch.
+    :return: Generator of RecordBatches in the table's export schema.
+    """
+    query, schema = EXPORT_TABLES[table]
+    cursor = get_connection(db_file or DB_FILE).execute(query)
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(column, type=field.type.value_type).dictionary_encode().cast(field.type)
+             if pa.types.is_dictionary(field.type) else pa.array(column, type=field.type)
+             for column, field in zip(columns, schema)],
+            schema=schema)
+
+
+def export_table(table, db_file=None, export_dir=EXPORT_DIR, file_format='parquet'):
+    """
+    Writes a table to files partitioned by patient and month, replacing any earlier export.
+
+    Rows are streamed from SQLite in batches, so the export runs in bounded memory.
+
+    :param table: Table name, one of EXPORT_TABLES.
+    :param db_file: Path to the SQLite database, defaults to DB_FILE.
+    :param export_dir: Directory holding the exported tables.
+    :param file_format: 'parquet', or 'ipc'/'arrow' for Arrow IPC files.
+    :return: Number of rows exported.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table '{table}'. Choose from: {', '.join(EXPORT_TABLES)}")
+    schema = EXPORT_TABLES[table][1]
+
+    rows = 0
+
+    def batches():
+        nonlocal rows
+        for batch in iter_record_batches(table, db_file):
+            rows += batch.num_rows
+            yield batch
+
+    ds.write_dataset(batches(), os.path.join(export_dir, table), schema=schema,
+                     format=get_format(file_format), partitioning=PARTITIONING,
+                     existing_data_behavior='delete_matching',
+                     basename_template=f"part-{{i}}.{get_format(file_format)}")
+    return rows
+
+
+def export_database(db_file=None, export_dir=EXPORT_DIR, file_format='parquet'):
+    """
+    Exports blood_sugar_log and insulin_doses for analytics.
+
+    :param db_file: Path to the SQLite database, defaults to DB_FILE.
+    :param export_dir: Directory holding the exported tables.
+    :param file_format: 'parquet', or 'ipc'/'arrow' for Arrow IPC files.
+    :return: Dictionary of table name to number of rows exported.
+    """
+    return {table: export_table(table, db_file, export_dir, file_format) for table in EXPORT_TABLES}
+
+
+def open_export(table, export_dir=EXPORT_DIR, file_format='parquet'):
+    """
+    Opens an exported table as a dataset whose files are memory-mapped when read.
+
+    :param table: Table name, one of EXPORT_TABLES.
+    :param export_dir: Directory holding the exported tables.
+    :param file_format: Format the table was exported in.
+    :return: pyarrow Dataset.
+    """
+    return ds.dataset(os.path.join(export_dir, table), format=get_format(file_format),
+                      partitioning=PARTITIONING, filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def build_filter(start=None, end=None, patient_id=None):
+    """
+    Builds a dataset filter over a time range.
+
+    The patient and month conditions prune whole partitions, and the timestamp
+    condition is checked against Parquet row group statistics before rows are read.
+
+    :param start: Earliest time to include, or None for no lower bound.
+    :param end: Latest time to include, or None for no upper bound.
+    :param patient_id: Only include rows for this patient.
+    :return: Dataset expression, or None for no filter.
+    """
+    conditions = []
+    if patient_id is not None:
+        conditions.append(ds.field('patient_id') == patient_id)
+    if start is not None:
+        start = to_epoch(start)
+        conditions.append(ds.field('month') >= from_epoch(start).strftime('%Y-%m'))
+        conditions.append(ds.field('timestamp') >= start)
+    if end is not None:
+        end = to_epoch(end)
+        conditions.append(ds.field('month') <= from_epoch(end).strftime('%Y-%m'))
+        conditions.append(ds.field('timestamp') <= end)
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def iter_blood_sugar_export(export_dir=EXPORT_DIR, start=None, end=None, columns=None, patient_id=None,
+                            file_format='parquet'):
+    """
+    Streams exported blood sugar readings within a time range in batches.
+
+    Only the requested columns are read, and batches have the same compact dtypes as
+    data_loader.iter_blood_sugar_data, so they can be passed to data_analysis.summarize_chunks.
+    Batches follow file order, which is only by timestamp within a partition.
+
+    :param export_dir: Directory holding the exported tables.
+    :param start: Earliest time to include, or None for no lower bound.
+    :param end: Latest time to include, or None for no upper bound.
+    :param columns: Columns to load, defaults to every blood_sugar_log column.
+    :param patient_id: Only include readings for this patient.
+    :param file_format: Format the table was exported in.
+    :return: Generator of pandas DataFrames.
+    """
+    columns = resolve_columns(columns)
+    scanner = open_export('blood_sugar_log', export_dir, file_format).scanner(
+        columns=columns, filter=build_filter(start, end, patient_id), batch_size=CHUNK_SIZE)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield compact_blood_sugar_frame(batch.to_pandas())
+
+
+def load_blood_sugar_export(export_dir=EXPORT_DIR, start=None, end=None, columns=None, patient_id=None,
+                            file_format='parquet'):
+    """
+    Loads exported blood sugar readings within a time range.
+
+    :param export_dir: Directory holding the exported tables.
+    :param start: Earliest time to include, or None for no lower bound.
+    :param end: Latest time to include, or None for no upper bound.
+    :param columns: Columns to load, defaults to every blood_sugar_log column.
+    :param patient_id: Only include readings for this patient.
+    :param file_format: Format the table was exported in.
+    :return: A pandas DataFrame ordered by timestamp.
+    """
+    table = open_export('blood_sugar_log', export_dir, file_format).to_table(
+        columns=resolve_columns(columns), filter=build_filter(start, end, patient_id))
+    table = table.sort_by('timestamp')
+    return compact_blood_sugar_frame(table.to_pandas(split_blocks=True, self_destruct=True))
+
+
+def load_insulin_export(export_dir=EXPORT_DIR, start=None, end=None, columns=None, patient_id=None,
+                        file_format='parquet'):
+    """
+    Loads exported insulin doses within a time range.
+
+    :param export_dir: Directory holding the exported tables.
+    :param start: Earliest time to include, or None for no lower bound.
+    :param end: Latest time to include, or None for no upper bound.
+    :param columns: Columns to load, defaults to every exported column.
+    :param patient_id: Only include doses linked to this patient's readings.
+    :param file_format: Format the table was exported in.
+    :return: A pandas DataFrame ordered by timestamp.
+    """
+    if columns is not None and 'timestamp' not in columns:
+        columns = list(columns) + ['timestamp']
+    table = open_export('insulin_doses', export_dir, file_format).to_table(
+        columns=columns, filter=build_filter(start, end, patient_id))
+    data = table.sort_by('timestamp').to_pandas(split_blocks=True, self_destruct=True)
+    data['timestamp'] = pd.to_datetime(data['timestamp'], unit='s')
+    return data
+
+
+if __name__ == "__main__":
+    file_format = sys.argv[1] if len(sys.argv) > 1 else 'parquet'
+    export_dir = sys.argv[2] if len(sys.argv) > 2 else EXPORT_DIR
+    for table, rows in export_database(export_dir=export_dir, file_format=file_format).items():
+        print(f"Exported {rows} {table} rows to {os.path.join(export_dir, table)}.")
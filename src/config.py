@@ -17,3 +17,8 @@ HEADERS = {
     'product': 'llu.android',
     'version': '4.7.0',
 }
+
+# Session settings
+TOKEN_EXPIRY_MARGIN = 60  # Seconds before expiry at which the JWT is renewed
+HTTP_POOL_SIZE = 10
+HTTP_TIMEOUT = 30
@@ -1,36 +1,75 @@
-import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime
+import numpy as np
 import pandas as pd
-from data_visualization import get_time_filter
-from dotenv import load_dotenv
 import os
-from data_visualization import generate_daily_summary, generate_daily_time_summary
-from utils import filter_blood_sugar_data
+from data_loader import load_blood_sugar_data, load_daily_stats, iter_blood_sugar_data, CHUNK_SIZE
+from utils import get_time_filter, to_epoch
+from analysis import get_thresholds
+from metrics import time_in_ranges, metrics_by_patient, epoch_seconds, interval_weights
 DB_FILE = '../data/sample_blood_sugar_data.db'
+# Directory of a Parquet export (see columnar.py) to analyse instead of the database, if set
+EXPORT_DIR = os.getenv('ANALYTICS_EXPORT_DIR')
+# Columns read for the summary views
+SUMMARY_COLUMNS = ['timestamp', 'glucose_value', 'alert_type']
 
 
-load_dotenv(dotenv_path='../login_example.env')
 
+def get_blood_sugar_data(db_file, start=None, end=None, columns=None, export_dir=None):
+    """
+    Gets blood sugar data within a time range.
+    :param db_file: Path to the database.
+    :param start: Earliest time to include, or None for no lower bound.
+    :param end: Latest time to include, or None for no upper bound.
+    :param columns: Columns to load, defaults to every column.
+    :param export_dir: Read from this Parquet export instead of the database.
+    :return: A pandas DataFrame containing blood sugar data.
+    """
+    if export_dir:
+        from columnar import load_blood_sugar_export
+        return load_blood_sugar_export(export_dir, start, end, columns)
+    return load_blood_sugar_data(db_file, start, end, columns)
 
 
-def get_blood_sugar_data(db_file):
+def get_blood_sugar_chunks(db_file, start=None, end=None, columns=None, chunksize=CHUNK_SIZE, export_dir=None):
     """
-    Gets blood sugar data and filters it based on a time range.
+    Streams blood sugar data within a time range in chunks, for summaries of long histories.
     :param db_file: Path to the database.
-    :return: A pandas DataFrame containing blood sugar data.
+    :param start: Earliest time to include, or None for no lower bound.
+    :param end: Latest time to include, or None for no upper bound.
+    :param columns: Columns to load, defaults to every column.
+    :param chunksize: Number of rows per chunk.
+    :param export_dir: Read from this Parquet export instead of the database.
+    :return: Generator of pandas DataFrames containing blood sugar data.
     """
-    con = sqlite3.connect(db_file)
-    cur = con.cursor()
-    data_query = """SELECT * FROM blood_sugar_log ORDER BY timestamp"""
-    data = pd.read_sql_query(data_query, con)
+    if export_dir:
+        from columnar import iter_blood_sugar_export
+        return iter_blood_sugar_export(export_dir, start, end, columns)
+    return iter_blood_sugar_data(db_file, start, end, columns, chunksize=chunksize)
+
+
+def glucose_as_float64(glucose):
+    '''
+    Widens float32 glucose values for summing.
+
+    float32 keeps about 7 significant digits, so rounding to 5 decimals restores the stored
+    readings and averages round the same way as on the float64 database values.
+    :param glucose: Series of glucose values.
+    :return: float64 Series.
+    '''
+    return glucose.astype('float64').round(5)
 
 
-    data['timestamp'] = pd.to_datetime(data['timestamp'], format='%m/%d/%Y %I:%M:%S %p', errors='coerce')
-    data = data.dropna(subset=['timestamp'])
-    data = data.sort_values(by='timestamp')
+def in_range_mask(glucose, thresholds):
+    '''
+    Flags glucose values within the target range.
 
-    con.close()
-    return data
+    Thresholds are cast to the values' dtype, so float32 readings on a threshold count as in range.
+    :param glucose: Series of glucose values.
+    :param thresholds: ThresholdProfile with the target range.
+    :return: Boolean Series.
+    '''
+    dtype = glucose.dtype.type if glucose.dtype.kind == 'f' else float
+    return (glucose >= dtype(thresholds.low)) & (glucose <= dtype(thresholds.high))
 
 def calculate_average_blood_sugar(blood_sugar_data):
     '''
@@ -39,7 +78,7 @@ def calculate_average_blood_sugar(blood_sugar_data):
     :return: Average blood sugar level
     '''
     try:
-        return blood_sugar_data['glucose_value'].mean()
+        return glucose_as_float64(blood_sugar_data['glucose_value']).mean()
     except KeyError as e:
         print("Error calculating average blood sugar: ", e)
         return None
@@ -51,37 +90,87 @@ def high_low_count(blood_sugar_data):
     :param blood_sugar_data: Blood sugar data table
     :return: Tuple containing number of high and low blood sugars.
     '''
-    high_count = 0
-    low_count = 0
-    for index, row in blood_sugar_data.iterrows():
-        if row['alert_type'] == 'High':
-            high_count += 1
-
-        if row['alert_type'] == 'Low':
-            low_count += 1
-
-    return high_count, low_count
+    alert_type = blood_sugar_data['alert_type']
+    return int((alert_type == 'High').sum()), int((alert_type == 'Low').sum())
 
 def get_time_in_range(blood_sugar_data):
     '''
     Calculates the percentage of time the blood sugar levels are in the target range.
 
+    Each reading is weighted by the time until the next reading of the same patient (capped,
+    see metrics.interval_weights), so sparse manual readings do not count the same as frequent
+    sensor readings. Each patient is measured against their own thresholds.
+
     :param blood_sugar_data: Blood sugar data table
     :return: Percentage of time in target range
     '''
-    high_glucose = float(os.getenv('HIGH_THRESHOLD'))
-    low_glucose = float(os.getenv('LOW_THRESHOLD'))
+    if len(blood_sugar_data) == 0:
+        return 0
+    if 'patient_id' in blood_sugar_data:
+        groups = blood_sugar_data.groupby('patient_id', observed=True, dropna=False, sort=False)
+    else:
+        groups = [(None, blood_sugar_data)]
 
+    in_range = minutes = 0.0
+    for patient_id, readings in groups:
+        patient_id = None if pd.isna(patient_id) else patient_id
+        if not readings['timestamp'].is_monotonic_increasing:
+            readings = readings.sort_values('timestamp')
+        times = epoch_seconds(readings['timestamp'])
+        covered = interval_weights(times).sum()
+        in_range += time_in_ranges(times, glucose_as_float64(readings['glucose_value']),
+                                   get_thresholds(patient_id))['in_range'] * covered
+        minutes += covered
+    return round(in_range / minutes, 2) if minutes else 0
 
-    glucose_in_range = blood_sugar_data[
-        (blood_sugar_data['glucose_value'] >= low_glucose) &
-        (blood_sugar_data['glucose_value'] <= high_glucose)]
+# Default time-of-day periods as name=start hour, overridable with TIME_PERIODS
+DEFAULT_TIME_PERIODS = "Morning=6,Afternoon=12,Evening=18,Night=0"
 
-    total_entries = len(blood_sugar_data)
-    if total_entries == 0:
-        return 0
 
-    return round((len(glucose_in_range)/total_entries) * 100,2)
+def get_time_periods():
+    """
+    Parses the time-of-day periods from the TIME_PERIODS environment variable.
+
+    Each period runs from its start hour until the next period starts, and the latest
+    period wraps past midnight until the earliest start (e.g., "Day=7,Night=19").
+
+    :return: List of (period name, start hour) tuples in the configured order.
+    """
+    periods = []
+    for entry in os.getenv('TIME_PERIODS', DEFAULT_TIME_PERIODS).split(','):
+        try:
+            name, start_hour = entry.split('=')
+            start_hour = int(start_hour)
+        except ValueError:
+            raise ValueError(f"Invalid time period '{entry.strip()}'. Use Name=StartHour.")
+        if not 0 <= start_hour < 24:
+            raise ValueError(f"Start hour for '{name.strip()}' must be between 0 and 23.")
+        periods.append((name.strip(), start_hour))
+
+    start_hours = [start_hour for _, start_hour in periods]
+    if len(set(start_hours)) != len(start_hours):
+        raise ValueError("Time periods must have distinct start hours.")
+    return periods
+
+
+def categorize_time_periods(timestamps):
+    """
+    Categorizes timestamps into time-of-day periods with vectorised binning on the hour.
+
+    :param timestamps: Series of timestamps.
+    :return: Categorical Series of period names, ordered as configured.
+    """
+    periods = get_time_periods()
+    boundaries = sorted(periods, key=lambda period: period[1])
+    categories = list(dict.fromkeys(name for name, _ in periods))
+
+    # Hours before the earliest start belong to the latest period, which wraps past midnight
+    bins = np.searchsorted([start_hour for _, start_hour in boundaries], timestamps.dt.hour.to_numpy(), side='right') - 1
+    bin_codes = np.array([categories.index(name) for name, _ in boundaries])
+    codes = bin_codes[bins % len(boundaries)]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories, ordered=True),
+                     index=timestamps.index)
+
 
 def categorize_time_of_day(timestamp):
     """
@@ -90,16 +179,99 @@ def categorize_time_of_day(timestamp):
     :param timestamp: Timestamp to categorize
     :return: Time period as a string
     """
+    return categorize_time_periods(pd.Series([pd.Timestamp(timestamp)])).iloc[0]
+
+
+# Functions deriving each supported grouping key from the timestamp column
+GROUPING_KEYS = {
+    'date': lambda timestamps: timestamps.dt.date,
+    'time_period': categorize_time_periods,
+    'hour': lambda timestamps: timestamps.dt.hour,
+    'weekday': lambda timestamps: timestamps.dt.day_name(),
+}
+
+
+def partial_summary(blood_sugar_data, key, thresholds=None):
+    """
+    Calculates the additive per-group sums behind a summary in a single groupby pass.
+
+    :param blood_sugar_data: Blood sugar data table.
+    :param key: Grouping key, one of GROUPING_KEYS (e.g., 'date' or 'hour').
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
+    :return: Data table indexed by group with glucose_sum, highs, lows, in_range and total_entries.
+    """
+    if key not in GROUPING_KEYS:
+        raise ValueError(f"Unknown grouping key '{key}'. Choose from: {', '.join(GROUPING_KEYS)}")
+
+    glucose = blood_sugar_data['glucose_value']
+    alert_type = blood_sugar_data['alert_type']
+
+    flags = pd.DataFrame({
+        key: GROUPING_KEYS[key](blood_sugar_data['timestamp']),
+        'glucose_value': glucose_as_float64(glucose),
+        'highs': alert_type == 'High',
+        'lows': alert_type == 'Low',
+        'in_range': in_range_mask(glucose, thresholds or get_thresholds()),
+    })
+    return flags.groupby(key, observed=True, sort=False).agg(
+        glucose_sum=('glucose_value', 'sum'),
+        highs=('highs', 'sum'),
+        lows=('lows', 'sum'),
+        in_range=('in_range', 'sum'),
+        total_entries=('glucose_value', 'size'),
+    )
+
+
+def finish_summary(sums, key):
+    """
+    Turns per-group sums from partial_summary into summary statistics.
+
+    :param sums: Data table from partial_summary, or several of them added together.
+    :param key: Grouping key the sums are indexed by.
+    :return: Data table with one row of summary statistics per group.
+    """
+    summary = sums.sort_index()
+    summary['average_glucose'] = (summary['glucose_sum'] / summary['total_entries']).round(2)
+    summary['time_in_range'] = (summary['in_range'] / summary['total_entries'] * 100).round(2)
+    summary.index.name = key
+    return summary.reset_index()[[key, 'average_glucose', 'highs', 'lows', 'time_in_range', 'total_entries']]
+
+
+def summarize(blood_sugar_data, key, thresholds=None):
+    """
+    Calculates average glucose, high/low counts, time in range and entry counts per group
+    in a single groupby pass.
+
+    :param blood_sugar_data: Blood sugar data table.
+    :param key: Grouping key, one of GROUPING_KEYS (e.g., 'date' or 'hour').
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
+    :return: Data table with one row of summary statistics per group.
+    """
+    return finish_summary(partial_summary(blood_sugar_data, key, thresholds), key)
+
+
+def summarize_chunks(chunks, key):
+    """
+    Summarises blood sugar data streamed in chunks (see get_blood_sugar_chunks).
+
+    Only the per-group sums are kept between chunks, so memory is bounded by the chunk
+    size and the number of groups rather than the length of the history.
+
+    :param chunks: Iterable of blood sugar data tables.
+    :param key: Grouping key, one of GROUPING_KEYS (e.g., 'date' or 'hour').
+    :return: Data table with one row of summary statistics per group.
+    """
+    thresholds = get_thresholds()
+    sums = None
+    for chunk in chunks:
+        partial = partial_summary(chunk, key, thresholds)
+        sums = partial if sums is None else sums.add(partial, fill_value=0)
+    if sums is None:
+        sums = pd.DataFrame(columns=['glucose_sum', 'highs', 'lows', 'in_range', 'total_entries'], dtype='float64')
+    return finish_summary(sums.astype({'highs': 'int64', 'lows': 'int64', 'in_range': 'int64',
+                                       'total_entries': 'int64'}), key)
+
 
-    hour = timestamp.hour  # Extract the hour from the timestamp
-    if 6 <= hour < 12:
-        return "Morning"
-    elif 12 <= hour < 18:
-        return "Afternoon"
-    elif 18 <= hour < 24:
-        return "Evening"
-    else:
-        return "Night"
 def time_based_summary(blood_sugar_data):
     """
     Groups blood sugar data by time-of-day and calculates average glucose.
@@ -107,45 +279,38 @@ def time_based_summary(blood_sugar_data):
     :param blood_sugar_data: Blood sugar data table.
     :return: Data table with summary statistics.
     """
-    # Add a time_period column
-    blood_sugar_data = blood_sugar_data.copy()
-    blood_sugar_data['time_period'] = blood_sugar_data['timestamp'].apply(categorize_time_of_day)
-
-    summary = []
-    for period, group in blood_sugar_data.groupby('time_period'):
-        avg_glucose = calculate_average_blood_sugar(group)
-        high_count, low_count = high_low_count(group)
-        time_in_range = get_time_in_range(group)
-        total_entries = len(group)
-        summary.append({
-            'time_period': period,
-            'average_glucose': round(avg_glucose,2),
-            'highs': high_count,
-            'lows': low_count,
-            'time_in_range': round(time_in_range,2),
-            'total_entries': total_entries
-        })
-    return pd.DataFrame(summary)
+    return summarize(blood_sugar_data, 'time_period')
 
 def daily_summary(blood_sugar_data):
-    blood_sugar_data = blood_sugar_data.copy()
-    blood_sugar_data['date'] = blood_sugar_data['timestamp'].dt.date
-
-    summary = []
-    for date, group in blood_sugar_data.groupby('date'):
-        avg_glucose = calculate_average_blood_sugar(group)
-        high_count, low_count = high_low_count(group)
-        time_in_range = get_time_in_range(group)
-        total_entries = len(group)
-        summary.append({
-            'date': date,
-            'average_glucose': round(avg_glucose, 2),
-            'highs': high_count,
-            'lows': low_count,
-            'time_in_range': round(time_in_range, 2),
-            'total_entries': total_entries
-        })
-    return pd.DataFrame(summary)
+    """
+    Groups blood sugar data by date and calculates average glucose.
+
+    :param blood_sugar_data: Blood sugar data table.
+    :return: Data table with summary statistics.
+    """
+    return summarize(blood_sugar_data, 'date')
+
+def starts_at_midnight(start):
+    """
+    Checks whether a time range starts on a day boundary, so the daily stats table covers it exactly.
+
+    :param start: Start of the time range, or None for no lower bound.
+    :return: True if start is None or midnight.
+    """
+    return start is None or to_epoch(start) % 86400 == 0
+
+def daily_summary_from_stats(db_file, start=None, end=None):
+    """
+    Reads the daily summary from the pre-aggregated daily_stats table instead of raw readings.
+
+    Whole days are read, so start should be midnight (see starts_at_midnight).
+
+    :param db_file: Path to the database.
+    :param start: Earliest time to include, or None for no lower bound.
+    :param end: Latest time to include, or None for no upper bound.
+    :return: Data table with summary statistics, one row per date.
+    """
+    return load_daily_stats(db_file, start, end)
 
 def display_main_menu():
     """Displays the main menu options."""
@@ -156,16 +321,21 @@ def display_main_menu():
     3. Display Amount of Highs 
     4. Display Amount of Lows
     5. Display Time in Range
-    6. Exit
+    6. Display Glycaemic Metrics
+    7. Exit
     """)
 
 
-def display_daily_summary_menu(blood_sugar_data):
+def display_daily_summary_menu(start_date=None):
     '''
     Handles and displays daily summary based on user input.
 
-    :param blood_sugar_data: Blood sugar data table.
+    Summaries are aggregated from readings streamed in chunks (see summarize_chunks), or read
+    from the daily stats table when grouping by date, so long ranges use bounded memory.
+
+    :param start_date: Start of the selected time range, or None for every reading.
     '''
+    from data_visualization import generate_daily_summary, generate_daily_time_summary
 
     while True:
         print("""
@@ -177,17 +347,23 @@ def display_daily_summary_menu(blood_sugar_data):
         try:
             choice = int(input("Please enter your choice: "))
             if choice == 1:
-                daily_stats = time_based_summary(blood_sugar_data)
+                daily_stats = summarize_chunks(get_blood_sugar_chunks(
+                    DB_FILE, start_date, datetime.now(), SUMMARY_COLUMNS, export_dir=EXPORT_DIR), 'time_period')
                 print("\nTime-Based Summary Statistics:")
                 print(daily_stats.to_string(index=False))
                 generate_daily_time_summary(daily_stats)
-                exit()
+                break
             elif choice == 2:
-                daily_stats = daily_summary(blood_sugar_data)
+                # The stats table holds whole days, so it only covers windows starting at midnight
+                if EXPORT_DIR or not starts_at_midnight(start_date):
+                    daily_stats = summarize_chunks(get_blood_sugar_chunks(
+                        DB_FILE, start_date, datetime.now(), SUMMARY_COLUMNS, export_dir=EXPORT_DIR), 'date')
+                else:
+                    daily_stats = daily_summary_from_stats(DB_FILE, start_date, datetime.now())
                 print("\nDaily Summary Statistics (by Date):")
                 print(daily_stats.to_string(index=False))
                 generate_daily_summary(daily_stats)
-                exit()
+                break
 
             elif choice == 3:
                 print("Returning to main menu...")
@@ -198,16 +374,17 @@ def display_daily_summary_menu(blood_sugar_data):
             print("Invalid input. Please enter a valid number.")
 
 
-def handle_user_choice(choice, blood_sugar_data):
+def handle_user_choice(choice, blood_sugar_data, start_date=None):
     """
     Executes the appropriate action based on the user's choice.
 
     :param choice: User's selection.
     :param blood_sugar_data: Blood sugar data table
+    :param start_date: Start of the selected time range
     :return: True if user opts to exit program, False otherwise
     """
     if choice == 1:
-        display_daily_summary_menu(blood_sugar_data)
+        display_daily_summary_menu(start_date)
     elif choice == 2:
         avg_glucose = calculate_average_blood_sugar(blood_sugar_data)
         print(f"\nAverage Glucose Over Selected Time Period: {avg_glucose:.2f} mmol/L")
@@ -221,6 +398,11 @@ def handle_user_choice(choice, blood_sugar_data):
         time_in_range = get_time_in_range(blood_sugar_data)
         print(f"\nTime In Range: {time_in_range}%")
     elif choice == 6:
+        print("\nGlycaemic Metrics (time-weighted, per patient):")
+        metrics = metrics_by_patient(blood_sugar_data)
+        metrics['patient_id'] = metrics['patient_id'].fillna('(no patient)')
+        print(metrics.set_index('patient_id').T.to_string())
+    elif choice == 7:
         print("Exiting program. Goodbye!")
         return True
     return False
@@ -228,12 +410,8 @@ def handle_user_choice(choice, blood_sugar_data):
 
 def main():
     """Main function to handle the analysis menu."""
-    blood_sugar_data = get_blood_sugar_data(DB_FILE)
-    if blood_sugar_data is None or blood_sugar_data.empty:
-        print("No blood sugar data available.")
-        return
-
-    filtered_data = filter_blood_sugar_data(blood_sugar_data)
+    start_date = get_time_filter()
+    filtered_data = get_blood_sugar_data(DB_FILE, start_date, datetime.now(), export_dir=EXPORT_DIR)
     if filtered_data is None or filtered_data.empty:
         print("No data available for the selected time range.")
         return
@@ -242,12 +420,12 @@ def main():
         display_main_menu()
         try:
             choice = int(input("Please enter your choice: "))
-            if 1 <= choice <= 6:
-                exit_program = handle_user_choice(choice, filtered_data)
+            if 1 <= choice <= 7:
+                exit_program = handle_user_choice(choice, filtered_data, start_date)
                 if exit_program:
                     break
             else:
-                print("Invalid option. Please enter a number between 1 and 6.")
+                print("Invalid option. Please enter a number between 1 and 7.")
         except ValueError:
             print("Invalid input. Please enter a valid number.")
 
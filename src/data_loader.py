@@ -0,0 +1,161 @@
+# data_loader.py
+import pandas as pd
+from database import get_connection
+from utils import to_epoch, from_epoch
+
+BLOOD_SUGAR_COLUMNS = ('id', 'patient_id', 'timestamp', 'glucose_value', 'alert_type', 'log_type', 'notes')
+
+# Compact dtypes of loaded blood_sugar_log columns; timestamps become datetime64, stored as int64
+BLOOD_SUGAR_DTYPES = {
+    'glucose_value': 'float32',
+    'alert_type': 'category',
+    'log_type': 'category',
+    'patient_id': 'category',
+}
+
+# Rows read per chunk by iter_blood_sugar_data
+CHUNK_SIZE = 50_000
+
+
+def build_range_query(table, columns, start=None, end=None, patient_id=None):
+    """
+    Builds a parameterised SELECT over a time range that the timestamp indexes can serve.
+
+    :param table: Table to query.
+    :param columns: Column names to select.
+    :param start: Earliest time to include (datetime, timestamp string or epoch seconds).
+    :param end: Latest time to include.
+    :param patient_id: Only include readings for this patient.
+    :return: Tuple of (query, params).
+    """
+    conditions = []
+    params = []
+    if patient_id is not None:
+        conditions.append("patient_id = ?")
+        params.append(patient_id)
+    if start is not None:
+        conditions.append("timestamp >= ?")
+        params.append(to_epoch(start))
+    if end is not None:
+        conditions.append("timestamp <= ?")
+        params.append(to_epoch(end))
+
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY timestamp"
+    return query, tuple(params)
+
+
+def resolve_columns(columns):
+    """
+    Validates requested blood_sugar_log columns, always including timestamp.
+
+    :param columns: Columns to load, or None for every blood_sugar_log column.
+    :return: List of column names.
+    """
+    columns = list(columns or BLOOD_SUGAR_COLUMNS)
+    unknown = set(columns) - set(BLOOD_SUGAR_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown blood_sugar_log columns: {', '.join(sorted(unknown))}")
+    if 'timestamp' not in columns:
+        columns.append('timestamp')
+    return columns
+
+
+def compact_blood_sugar_frame(data):
+    """
+    Converts blood_sugar_log columns to their compact dtypes in place.
+
+    :param data: DataFrame read from blood_sugar_log with epoch timestamps.
+    :return: The same DataFrame.
+    """
+    data['timestamp'] = pd.to_datetime(data['timestamp'].astype('int64'), unit='s')
+    for column, dtype in BLOOD_SUGAR_DTYPES.items():
+        if column in data:
+            data[column] = data[column].astype(dtype)
+    return data
+
+
+def iter_blood_sugar_data(db_file, start=None, end=None, columns=None, patient_id=None, chunksize=CHUNK_SIZE):
+    """
+    Streams blood sugar readings within a time range in chunks with compact dtypes.
+
+    Only one chunk is held in memory at a time, so histories of any length can be
+    aggregated in bounded memory (see data_analysis.summarize_chunks).
+
+    :param db_file: Path to the database.
+    :param start: Earliest time to include, or None for no lower bound.
+    :param end: Latest time to include, or None for no upper bound.
+    :param columns: Columns to load, defaults to every blood_sugar_log column.
+    :param patient_id: Only include readings for this patient.
+    :param chunksize: Number of rows per chunk.
+    :return: Generator of pandas DataFrames ordered by timestamp.
+    """
+    columns = resolve_columns(columns)
+    query, params = build_range_query('blood_sugar_log', columns, start, end, patient_id)
+    for chunk in pd.read_sql_query(query, get_connection(db_file), params=params, chunksize=chunksize):
+        yield compact_blood_sugar_frame(chunk)
+
+
+def load_blood_sugar_data(db_file, start=None, end=None, columns=None, patient_id=None):
+    """
+    Loads blood sugar readings within a time range.
+
+    Only the requested columns and rows are read from the database, so load time and
+    memory grow with the window rather than the full history. Columns use the compact
+    dtypes of BLOOD_SUGAR_DTYPES.
+
+    :param db_file: Path to the database.
+    :param start: Earliest time to include, or None for no lower bound.
+    :param end: Latest time to include, or None for no upper bound.
+    :param columns: Columns to load, defaults to every blood_sugar_log column.
+    :param patient_id: Only include readings for this patient.
+    :return: A pandas DataFrame ordered by timestamp.
+    """
+    columns = resolve_columns(columns)
+    query, params = build_range_query('blood_sugar_log', columns, start, end, patient_id)
+    # One read converted in place; use iter_blood_sugar_data to aggregate in bounded memory
+    return compact_blood_sugar_frame(pd.read_sql_query(query, get_connection(db_file), params=params))
+
+
+def load_daily_stats(db_file, start=None, end=None, patient_id=None):
+    """
+    Loads the pre-aggregated daily statistics within a date range.
+
+    :param db_file: Path to the database.
+    :param start: Earliest time to include, or None for no lower bound.
+    :param end: Latest time to include, or None for no upper bound.
+    :param patient_id: Only include this patient, or None to combine every patient.
+    :return: A pandas DataFrame with date, average_glucose, highs, lows, time_in_range
+             and total_entries, one row per day.
+    """
+    conditions = []
+    params = []
+    if patient_id is not None:
+        conditions.append("patient_id = ?")
+        params.append(patient_id)
+    if start is not None:
+        conditions.append("day >= ?")
+        params.append(from_epoch(to_epoch(start)).strftime('%Y-%m-%d'))
+    if end is not None:
+        conditions.append("day <= ?")
+        params.append(from_epoch(to_epoch(end)).strftime('%Y-%m-%d'))
+
+    query = """
+    SELECT day, SUM(glucose_sum) AS glucose_sum, SUM(high_count) AS highs, SUM(low_count) AS lows,
+           SUM(in_range_count) AS in_range, SUM(reading_count) AS total_entries
+    FROM daily_stats"""
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " GROUP BY day ORDER BY day"
+    stats = pd.read_sql_query(query, get_connection(db_file), params=tuple(params))
+
+    return pd.DataFrame({
+        'date': pd.to_datetime(stats['day']).dt.date,
+        'average_glucose': (stats['glucose_sum'] / stats['total_entries']).round(2),
+        'highs': stats['highs'],
+        'lows': stats['lows'],
+        'time_in_range': (stats['in_range'] / stats['total_entries'] * 100).round(2),
+        'total_entries': stats['total_entries'],
+    })
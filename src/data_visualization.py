@@ -1,24 +1,19 @@
-
+import sys
+import numpy as np
 import pandas as pd
-import matplotlib
-matplotlib.use('TkAgg')  # Use this before importing pyplot
-import matplotlib.pyplot as plt
 from matplotlib.dates import DateFormatter, num2date
-import sqlite3
+from matplotlib.figure import Figure
 from datetime import datetime
-from dotenv import load_dotenv
-import os
 from utils import get_time_filter
-import mplcursors
-
+from data_loader import load_blood_sugar_data
+from analysis import get_thresholds
 
-load_dotenv(dotenv_path='../login_example.env')
 
 DB_FILE = '../data/sample_blood_sugar_data.db'
 
-#Constants for threshold values
-LOW_THRESHOLD = float(os.getenv('LOW_THRESHOLD'))
-HIGH_THRESHOLD = float(os.getenv('HIGH_THRESHOLD'))
+# Most points drawn for a glucose line; longer series are downsampled keeping each bucket's min and max
+MAX_PLOT_POINTS = 4000
+
 def get_blood_sugar_data():
     '''
     Gets blood sugar and timestamp based on a time range given by the user.
@@ -26,28 +21,9 @@ def get_blood_sugar_data():
     :return: A pandas dataframe with blood sugar data.
     '''
     try:
-        con = sqlite3.connect(DB_FILE)
-        blood_sugar_query = "SELECT timestamp, glucose_value FROM blood_sugar_log ORDER BY timestamp;"
-        blood_sugar_data = pd.read_sql_query(blood_sugar_query, con)
-        con.close()
-
-        # Parse timestamps with a specific format
-        blood_sugar_data['timestamp'] = pd.to_datetime(
-            blood_sugar_data['timestamp'],
-            format='%m/%d/%Y %I:%M:%S %p',  # Replace with your actual timestamp format
-            errors='coerce'
-        )
-        blood_sugar_data.dropna(subset=['timestamp'], inplace=True)
-
-
-
         start_date = get_time_filter()
         end_date = datetime.now()
-        filtered_data = blood_sugar_data[
-            (blood_sugar_data['timestamp'] >= start_date) &
-            (blood_sugar_data['timestamp'] <= end_date)
-            ]
-        return filtered_data
+        return load_blood_sugar_data(DB_FILE, start_date, end_date, columns=['timestamp', 'glucose_value'])
 
     except Exception as e:
         print(f"Error fetching or filtering blood sugar data: {e}")
@@ -64,15 +40,14 @@ def set_textbox_color(sel):
     """
     try:
         # Retrieve thresholds
-        LOW_THRESHOLD = 3.9
-        HIGH_THRESHOLD = 9.0
+        thresholds = get_thresholds()
 
         glucose_value = sel.target[1]  # Glucose level
 
         # Determine the annotation color
-        if glucose_value < LOW_THRESHOLD:
+        if glucose_value < thresholds.low:
             colour = 'red'  # Low glucose
-        elif glucose_value > HIGH_THRESHOLD:
+        elif glucose_value > thresholds.high:
             colour = 'orange'  # High glucose
         else:
             colour = 'green'  # Normal range
@@ -90,40 +65,91 @@ def set_textbox_color(sel):
     except AttributeError as e:
         print(f"Annotation error: {e}")
 
-def plot_blood_sugar_data(blood_sugar_data):
+def new_figure(output=None):
+    '''
+    Creates a figure for a plot.
+
+    Figures for an output file are rendered headlessly without pyplot, so no GUI toolkit
+    is loaded and no global figure state is kept between reports.
+
+    :param output: File the plot will be saved to, or None to show it interactively.
+    :return: Tuple of (figure, axes).
+    '''
+    if output is None:
+        import matplotlib.pyplot as plt
+        figure = plt.figure(figsize=(12, 8))
+    else:
+        figure = Figure(figsize=(12, 8))
+    return figure, figure.add_subplot()
+
+
+def finish_figure(figure, output=None):
+    '''
+    Shows a figure interactively or saves it to a file.
+
+    :param figure: Figure from new_figure.
+    :param output: File to save to, its extension choosing the format (e.g., .png or .svg), or None to show.
+    '''
+    figure.tight_layout()
+    if output is None:
+        import matplotlib.pyplot as plt
+        plt.show()
+    else:
+        figure.savefig(output)
+
+
+def downsample_min_max(blood_sugar_data, max_points=MAX_PLOT_POINTS):
+    '''
+    Reduces sorted blood sugar data to at most max_points rows for plotting.
+
+    Rows are split into max_points / 2 equal-sized buckets and the lowest and highest
+    reading of each bucket are kept, so highs and lows stay visible at any range.
+
+    :param blood_sugar_data: Blood sugar data table ordered by timestamp.
+    :param max_points: Maximum number of rows to keep.
+    :return: Data table with the kept rows in time order.
+    '''
+    count = len(blood_sugar_data)
+    if count <= max_points:
+        return blood_sugar_data
+
+    buckets = max(max_points // 2, 1)
+    edges = np.linspace(0, count, buckets + 1).astype(int)
+    bucket_ids = np.repeat(np.arange(buckets), np.diff(edges))
+
+    # Sort by bucket, then by value, so each bucket's first and last positions hold its min and max
+    order = np.lexsort((blood_sugar_data['glucose_value'].to_numpy(), bucket_ids))
+    keep = np.unique(np.concatenate([order[edges[:-1]], order[edges[1:] - 1]]))
+    return blood_sugar_data.iloc[keep]
+
+
+def plot_blood_sugar_data(blood_sugar_data, output=None, max_points=MAX_PLOT_POINTS):
     '''
     Plots blood sugar data with a green shaded region for the target range and markers for highs and lows.
 
     :param blood_sugar_data: Blood sugar data table.
+    :param output: File to save the plot to (e.g., report.png or report.svg), or None to show it.
+    :param max_points: Maximum number of points drawn, see downsample_min_max.
     '''
-    global LOW_THRESHOLD, HIGH_THRESHOLD
-
     if blood_sugar_data.empty:
         print("No data available.")
         return
 
-    try:
-        # Parse timestamps
-        blood_sugar_data['timestamp'] = pd.to_datetime(blood_sugar_data['timestamp'], format='%m/%d/%Y %I:%M:%S %p', errors='coerce')
+    thresholds = get_thresholds()
+    low_threshold, high_threshold = thresholds.low, thresholds.high
 
-        # Drops invalid timestamps
-        blood_sugar_data = blood_sugar_data.dropna(subset=['timestamp'])
+    if not blood_sugar_data['timestamp'].is_monotonic_increasing:
         blood_sugar_data = blood_sugar_data.sort_values(by='timestamp')
-
-    except Exception as e:
-        print("Error parsing timestamps: ", e)
-        return
-
-
+    blood_sugar_data = downsample_min_max(blood_sugar_data, max_points)
 
     # Initializing plot
-    plt.figure(figsize=(12, 8))
+    figure, ax = new_figure(output)
 
     # Adding target range
-    plt.axhspan(LOW_THRESHOLD, HIGH_THRESHOLD, color='green', alpha=0.1, label='Target Range')
+    ax.axhspan(low_threshold, high_threshold, color='green', alpha=0.1, label='Target Range')
 
 
-    plt.plot(
+    ax.plot(
         blood_sugar_data['timestamp'],
         blood_sugar_data['glucose_value'],
         label='Blood Sugar Level',
@@ -132,118 +158,157 @@ def plot_blood_sugar_data(blood_sugar_data):
         )
 
     # Highlights highs and lows
-    plt.scatter(blood_sugar_data['timestamp'][blood_sugar_data['glucose_value'] < LOW_THRESHOLD],
-                blood_sugar_data['glucose_value'][blood_sugar_data['glucose_value'] < LOW_THRESHOLD],
+    ax.scatter(blood_sugar_data['timestamp'][blood_sugar_data['glucose_value'] < low_threshold],
+                blood_sugar_data['glucose_value'][blood_sugar_data['glucose_value'] < low_threshold],
                 color='red',
                 label='Low Blood Sugar',
                 zorder=3)
 
-    plt.scatter(blood_sugar_data['timestamp'][blood_sugar_data['glucose_value'] > HIGH_THRESHOLD],
-                blood_sugar_data['glucose_value'][blood_sugar_data['glucose_value'] > HIGH_THRESHOLD],
+    ax.scatter(blood_sugar_data['timestamp'][blood_sugar_data['glucose_value'] > high_threshold],
+                blood_sugar_data['glucose_value'][blood_sugar_data['glucose_value'] > high_threshold],
                 color='orange',
                 label='High Blood Sugar',
                 zorder = 3)
 
-    cursor = mplcursors.cursor(hover=True)
-    cursor.connect("add", lambda sel: set_textbox_color(sel))
+    if output is None:
+        import mplcursors
+        cursor = mplcursors.cursor(ax, hover=True)
+        cursor.connect("add", lambda sel: set_textbox_color(sel))
 
 
 
     # Threshold lines
-    plt.axhline(y=LOW_THRESHOLD, color='red', linestyle='--', label='Low Threshold (3.9 mmol/L)')
-    plt.axhline(y=HIGH_THRESHOLD, color='orange', linestyle='--', label='High Threshold (9.0 mmol/L)')
+    ax.axhline(y=low_threshold, color='red', linestyle='--', label=f'Low Threshold ({low_threshold} mmol/L)')
+    ax.axhline(y=high_threshold, color='orange', linestyle='--', label=f'High Threshold ({high_threshold} mmol/L)')
 
     # Formats x-axis
-    plt.gca().xaxis.set_major_formatter(DateFormatter('%m/%d %H:%M'))
-    plt.xticks(rotation=45)
+    ax.xaxis.set_major_formatter(DateFormatter('%m/%d %H:%M'))
+    ax.tick_params(axis='x', labelrotation=45)
 
-    plt.title("Blood Sugar Over Time")
-    plt.xlabel("Time")
-    plt.ylabel("Glucose Level (mmol/L)")
-    plt.legend()
-    plt.grid(True)
+    ax.set_title("Blood Sugar Over Time")
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Glucose Level (mmol/L)")
+    ax.legend()
+    ax.grid(True)
 
 
-    plt.tight_layout()
-    plt.show()
+    finish_figure(figure, output)
 
 
 
-def generate_daily_summary(daily_summary_data):
+def generate_daily_summary(daily_summary_data, output=None):
     '''
     Generate a line graph of daily average glucose levels.
 
     :param daily_summary_data: Pandas datagrame containing date and average_glucose.
+    :param output: File to save the graph to, or None to show it.
     '''
     if daily_summary_data.empty:
        print("No data available for daily summary plot.")
        return
 
-    plt.figure(figsize=(12, 8))
+    thresholds = get_thresholds()
+
+    figure, ax = new_figure(output)
 
-    plt.plot(
+    ax.plot(
        daily_summary_data['date'],
        daily_summary_data['average_glucose'],
        label='Average Blood Sugar', color='black',
        marker='o', linewidth=2)
 
-    plt.gca().xaxis.set_major_formatter(DateFormatter('%m/%d'))
-    plt.xticks(rotation=45, fontsize=10)
-    plt.yticks(fontsize=10)
+    ax.xaxis.set_major_formatter(DateFormatter('%m/%d'))
+    ax.tick_params(axis='x', labelrotation=45, labelsize=10)
+    ax.tick_params(axis='y', labelsize=10)
 
     # Adds shaded green region for target range
-    plt.axhspan(4.0, 9.0, color='green', alpha=0.1, label='Target Range')
+    ax.axhspan(thresholds.low, thresholds.high, color='green', alpha=0.1, label='Target Range')
 
-    plt.axhline(y=3.9, color='red', linestyle='--', label='Low Threshold (3.9 mmol/L)')
-    plt.axhline(y=9.0, color='orange', linestyle='--', label='High Threshold (9.0 mmol/L)')
+    ax.axhline(y=thresholds.low, color='red', linestyle='--', label=f'Low Threshold ({thresholds.low} mmol/L)')
+    ax.axhline(y=thresholds.high, color='orange', linestyle='--', label=f'High Threshold ({thresholds.high} mmol/L)')
 
 
-    plt.title("Daily Average Glucose Levels", fontsize=16)
-    plt.xlabel("Date", fontsize=12)
-    plt.ylabel("Average Glucose Level (mmol/L)", fontsize=12)
-    plt.legend()
-    plt.grid(True, linestyle='--', alpha=0.5)
+    ax.set_title("Daily Average Glucose Levels", fontsize=16)
+    ax.set_xlabel("Date", fontsize=12)
+    ax.set_ylabel("Average Glucose Level (mmol/L)", fontsize=12)
+    ax.legend()
+    ax.grid(True, linestyle='--', alpha=0.5)
 
 
-    plt.tight_layout()
-    plt.show()
+    finish_figure(figure, output)
 
-def generate_daily_time_summary(daily_time_summary_data):
+def generate_daily_time_summary(daily_time_summary_data, output=None):
     '''
     Generate a bar graph of average glucose levels at different periods of the day.
 
     :param daily_time_summary_data: Pandas datagrame containing time_period and average_glucose.
+    :param output: File to save the graph to, or None to show it.
     '''
 
-    global LOW_THRESHOLD, HIGH_THRESHOLD
     if daily_time_summary_data.empty:
        print("No data available for daily time summary plot.")
        return
 
+    thresholds = get_thresholds()
+
 
-    plt.figure(figsize=(12, 8))
+    figure, ax = new_figure(output)
 
-    plt.bar(
-       daily_time_summary_data['time_period'],
+    ax.bar(
+       daily_time_summary_data['time_period'].astype(str),
        daily_time_summary_data['average_glucose'],
        label='Average Blood Sugar',
        color='blue'
     )
 
-    plt.axhspan(4.0, 9.0, color='green', alpha=0.1, label='Target Range')
+    ax.axhspan(thresholds.low, thresholds.high, color='green', alpha=0.1, label='Target Range')
+
+    ax.axhline(y=thresholds.low, color='red', linestyle='--', label=f'Low Threshold ({thresholds.low} mmol/L)')
+    ax.axhline(y=thresholds.high, color='orange', linestyle='--', label=f'High Threshold ({thresholds.high} mmol/L)')
+
+
+    ax.set_title("Daily Average Glucose Levels", fontsize=16)
+    ax.set_xlabel("Time Period", fontsize=12)
+    ax.set_ylabel("Average Glucose Level (mmol/L)", fontsize=12)
+    ax.legend()
+    ax.grid(True, linestyle='--', alpha=0.5)
+
+    finish_figure(figure, output)
+
+def generate_agp_plot(profile, output=None):
+    '''
+    Generate an Ambulatory Glucose Profile graph with the 5-95% and 25-75% bands and the median.
+
+    :param profile: Pandas dataframe from agp.get_agp with time and p5 to p95 columns.
+    :param output: File to save the graph to, or None to show it.
+    '''
+    if profile.empty or profile['p50'].isna().all():
+        print("No data available for the glucose profile plot.")
+        return
+
+    thresholds = get_thresholds()
+    minutes = [int(time[:2]) * 60 + int(time[3:]) for time in profile['time']]
+
+    figure, ax = new_figure(output)
+
+    ax.fill_between(minutes, profile['p5'], profile['p95'], color='blue', alpha=0.15, label='5-95%')
+    ax.fill_between(minutes, profile['p25'], profile['p75'], color='blue', alpha=0.35, label='25-75%')
+    ax.plot(minutes, profile['p50'], color='black', linewidth=2, label='Median')
 
-    plt.axhline(y=LOW_THRESHOLD, color='red', linestyle='--', label='Low Threshold (3.9 mmol/L)')
-    plt.axhline(y=HIGH_THRESHOLD, color='orange', linestyle='--', label='High Threshold (9.0 mmol/L)')
+    ax.axhspan(thresholds.low, thresholds.high, color='green', alpha=0.1, label='Target Range')
+    ax.axhline(y=thresholds.low, color='red', linestyle='--', label=f'Low Threshold ({thresholds.low} mmol/L)')
+    ax.axhline(y=thresholds.high, color='orange', linestyle='--', label=f'High Threshold ({thresholds.high} mmol/L)')
 
+    ax.set_xticks(range(0, 1441, 180), [f"{hour:02d}:00" for hour in range(0, 25, 3)])
+    ax.set_xlim(0, 1440)
 
-    plt.title("Daily Average Glucose Levels", fontsize=16)
-    plt.xlabel("Time Period", fontsize=12)
-    plt.ylabel("Average Glucose Level (mmol/L)", fontsize=12)
-    plt.legend()
-    plt.grid(True, linestyle='--', alpha=0.5)
+    ax.set_title("Ambulatory Glucose Profile", fontsize=16)
+    ax.set_xlabel("Time of Day", fontsize=12)
+    ax.set_ylabel("Glucose Level (mmol/L)", fontsize=12)
+    ax.legend()
+    ax.grid(True, linestyle='--', alpha=0.5)
 
-    plt.tight_layout()
-    plt.show()
+    finish_figure(figure, output)
 
 if __name__ == "__main__":
 
@@ -252,7 +317,8 @@ if __name__ == "__main__":
     if blood_sugar_data.empty:
         print("No data available to plot after filtering.")
     else:
-        plot_blood_sugar_data(blood_sugar_data)
+        # An optional file argument renders the plot headlessly (e.g., report.png or report.svg)
+        plot_blood_sugar_data(blood_sugar_data, output=sys.argv[1] if len(sys.argv) > 1 else None)
 
 
 
@@ -1,8 +1,24 @@
+import bisect
 import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
 from sqlite3 import Error
+from analysis import get_thresholds
+from utils import to_epoch, from_epoch
 
 DB_FILE = '../data/sample_blood_sugar_data.db'
 
+# Size of each connection's prepared statement cache
+STATEMENT_CACHE_SIZE = 256
+
+# Long-lived connections, one per thread and database file
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+# Incremented by close_connections, so threads drop connections opened before it
+_generation = 0
+
 
 def setup_connection(db_file):
     '''
@@ -19,44 +35,333 @@ def setup_connection(db_file):
     return None
 
 
-def setup_database():
+def get_connection(db_file=None):
     '''
-    Sets up the database by creating tables if they do not exist.
+    Returns this thread's long-lived connection to the database, opening it on first use.
+
+    Connections use WAL journaling so readers never block the monitor's writes, and
+    synchronous=NORMAL so a commit does not wait for a full fsync.
 
+    :param db_file: Path to the SQLite database, defaults to DB_FILE.
+    :return: Connection object in autocommit mode; use transaction() to group writes.
     '''
-    conn = setup_connection(DB_FILE)
+    db_file = db_file or DB_FILE
+    connections = getattr(_local, 'connections', None)
+    if connections is None or getattr(_local, 'generation', None) != _generation:
+        # Connections cached before the last close_connections are closed already
+        connections = _local.connections = {}
+        _local.generation = _generation
+
+    conn = connections.get(db_file)
+    if conn is None:
+        conn = sqlite3.connect(db_file, timeout=30, isolation_level=None,
+                               cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[db_file] = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+def close_connections():
+    '''
+    Closes every pooled connection opened by any thread.
+
+    Each thread, including threads other than the caller, opens a new connection on its
+    next get_connection call.
+    '''
+    global _generation
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+        _generation += 1
+
+
+@contextmanager
+def transaction(db_file=None):
+    '''
+    Groups statements into one transaction on this thread's connection.
+
+    The transaction commits when the block exits and rolls back if it raises.
+    Nested blocks join the outermost transaction.
+
+    :param db_file: Path to the SQLite database, defaults to DB_FILE.
+    :return: Connection object to run statements on.
+    '''
+    conn = get_connection(db_file)
+    depth = getattr(_local, 'depth', 0)
+    if depth:
+        _local.depth = depth + 1
+        try:
+            yield conn
+        finally:
+            _local.depth = depth
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    _local.depth = 1
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        _local.depth = 0
+
+
+# Version 2 stores timestamps as integer epoch seconds (see utils.to_epoch) with time indexes,
+# version 3 adds the daily_stats and hourly_stats aggregate tables,
+# version 4 adds the alert_state rate-limit table,
+# version 5 removes duplicate readings and makes (patient_id, timestamp) unique
+SCHEMA_VERSION = 5
+
+BLOOD_SUGAR_LOG_TABLE = """
+    CREATE TABLE IF NOT EXISTS blood_sugar_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        timestamp INTEGER NOT NULL,
+        glucose_value REAL NOT NULL,
+        alert_type TEXT,
+        log_type TEXT,
+        notes TEXT
+    )
+"""
+
+INSULIN_DOSES_TABLE = """
+    CREATE TABLE IF NOT EXISTS insulin_doses(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        dosage_amount REAL NOT NULL,
+        dosage_type TEXT,
+        entry_type TEXT,
+        carbs REAL,
+        related_log_id INTEGER,
+        FOREIGN KEY(related_log_id) REFERENCES blood_sugar_log(id)
+    )
+"""
+
+# Aggregates per patient (empty string when unknown) and day or hour, kept up to date on insert
+STATS_TABLE = """
+    CREATE TABLE IF NOT EXISTS {table}(
+        patient_id TEXT NOT NULL,
+        {period} NOT NULL,
+        reading_count INTEGER NOT NULL,
+        glucose_sum REAL NOT NULL,
+        in_range_count INTEGER NOT NULL,
+        high_count INTEGER NOT NULL,
+        low_count INTEGER NOT NULL,
+        min_glucose REAL,
+        max_glucose REAL,
+        PRIMARY KEY(patient_id, {period_column})
+    )
+"""
+
+# Stats table name, period column definition and SQL expression deriving the period from timestamp
+STATS_PERIODS = {
+    'daily_stats': ("day TEXT", "date(timestamp, 'unixepoch')"),
+    'hourly_stats': ("hour INTEGER", "timestamp - timestamp % 3600"),
+}
+
+# Token bucket per patient and alert type, shared by every monitor process using the database
+ALERT_STATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS alert_state(
+        patient_id TEXT NOT NULL,
+        alert_type TEXT NOT NULL,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        last_sent REAL,
+        PRIMARY KEY(patient_id, alert_type)
+    )
+"""
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_blood_sugar_log_timestamp ON blood_sugar_log(timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_insulin_doses_timestamp ON insulin_doses(timestamp)",
+    # One reading per patient and time; unique indexes treat NULLs as distinct, so readings
+    # without a patient get their own partial index
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_blood_sugar_log_patient_timestamp_unique "
+    "ON blood_sugar_log(patient_id, timestamp)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_blood_sugar_log_no_patient_timestamp_unique "
+    "ON blood_sugar_log(timestamp) WHERE patient_id IS NULL",
+]
+
+
+def create_schema(cur, indexes=True):
+    '''
+    Creates the current schema's tables and indexes if they do not exist.
+
+    :param cur: Database cursor.
+    :param indexes: Whether to create the indexes, which a migration does once the data is cleaned.
+    '''
+    cur.execute(BLOOD_SUGAR_LOG_TABLE)
+    cur.execute(INSULIN_DOSES_TABLE)
+    cur.execute(ALERT_STATE_TABLE)
+    for table, (period, _) in STATS_PERIODS.items():
+        cur.execute(STATS_TABLE.format(table=table, period=period, period_column=period.split()[0]))
+    if indexes:
+        for index in INDEXES:
+            cur.execute(index)
+    cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def table_columns(cur, table):
+    '''
+    Lists the column names of a table.
+
+    :param cur: Database cursor.
+    :param table: Table name.
+    :return: List of column names, empty if the table does not exist.
+    '''
+    return [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]
+
+
+def migrate_timestamps(cur, table, columns):
+    '''
+    Rebuilds a table from the text-timestamp schema, converting every timestamp to epoch seconds.
+
+    :param cur: Database cursor.
+    :param table: Table name.
+    :param columns: Columns of the new table in insert order, starting with id and timestamp.
+    :return: Number of rows that could not be converted and were dropped.
+    '''
+    old_columns = table_columns(cur, f"{table}_v1")
+    select_columns = ", ".join(column if column in old_columns else "NULL" for column in columns)
+    rows = cur.execute(f"SELECT {select_columns} FROM {table}_v1 ORDER BY id").fetchall()
+
+    converted = []
+    for row in rows:
+        try:
+            converted.append((row[0], to_epoch(row[1])) + tuple(row[2:]))
+        except (TypeError, ValueError):
+            print(f"Skipping {table} row {row[0]} with invalid timestamp: {row[1]}")
+
+    placeholders = ",".join("?" * len(columns))
+    cur.executemany(f"INSERT INTO {table}({', '.join(columns)}) VALUES ({placeholders})", converted)
+    cur.execute(f"DROP TABLE {table}_v1")
+    return len(rows) - len(converted)
+
+
+def remove_duplicate_readings(cur):
+    '''
+    Deletes repeated readings of the same patient and time, keeping one per group.
+
+    The kept reading is the first logged one whose alert_type is 'High' or 'Low', the values
+    the stats tables count, or else the first logged one, so the choice does not depend on
+    insert order alone. Insulin doses linked to a deleted reading are relinked to the one that
+    is kept; the stats tables must be rebuilt afterwards.
+
+    :param cur: Database cursor with an open transaction.
+    :return: Number of readings deleted.
+    '''
+    cur.execute("""
+    CREATE TEMP TABLE duplicate_readings AS
+    SELECT id, kept_id FROM (
+        SELECT id, FIRST_VALUE(id) OVER (
+            PARTITION BY COALESCE(patient_id, ''), timestamp
+            ORDER BY COALESCE(alert_type IN ('High', 'Low'), 0) DESC, id) AS kept_id
+        FROM blood_sugar_log)
+    WHERE id != kept_id
+    """)
+    cur.execute("""
+    UPDATE insulin_doses SET related_log_id = (
+        SELECT kept_id FROM duplicate_readings WHERE id = insulin_doses.related_log_id)
+    WHERE related_log_id IN (SELECT id FROM duplicate_readings)
+    """)
+    cur.execute("DELETE FROM blood_sugar_log WHERE id IN (SELECT id FROM duplicate_readings)")
+    deleted = cur.rowcount
+    cur.execute("DROP TABLE duplicate_readings")
+    return deleted
+
+
+def migrate_database(db_file=None):
+    '''
+    Migrates a database from an older schema version to the current one in place.
+
+    Every step runs inside one transaction, so a failed migration leaves the database
+    unchanged.
+
+    :param db_file: Path to the SQLite database, defaults to DB_FILE.
+    '''
+    conn = setup_connection(db_file or DB_FILE)
     if conn is None:
         print("Unable to connect to SQLite database.")
         return
     try:
         cur = conn.cursor()
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            print(f"Database is already at schema version {version}.")
+            return
+
+        cur.execute("BEGIN")
+        skipped = 0
+        if version < 2:
+            # Rebuild the tables with text timestamps as epoch seconds
+            existing = [table for table in ("blood_sugar_log", "insulin_doses") if table_columns(cur, table)]
+            for table in existing:
+                cur.execute(f"ALTER TABLE {table} RENAME TO {table}_v1")
+            create_schema(cur, indexes=False)
+
+            if "blood_sugar_log" in existing:
+                skipped += migrate_timestamps(cur, "blood_sugar_log", [
+                    "id", "timestamp", "patient_id", "glucose_value", "alert_type", "log_type", "notes"])
+            if "insulin_doses" in existing:
+                skipped += migrate_timestamps(cur, "insulin_doses", [
+                    "id", "timestamp", "dosage_amount", "dosage_type", "entry_type", "carbs", "related_log_id"])
+
+        duplicates = 0
+        if version < 5:
+            # Replaced by the unique index created with the schema
+            cur.execute("DROP INDEX IF EXISTS idx_blood_sugar_log_patient_timestamp")
+            duplicates = remove_duplicate_readings(cur)
+
+        create_schema(cur)
+        if version < 3 or duplicates:
+            rebuild_stats(cur)
+
+        conn.commit()
+        print(f"Migrated database to schema version {SCHEMA_VERSION} "
+              f"({skipped} invalid rows skipped, {duplicates} duplicate readings removed).")
+    except Error as e:
+        conn.rollback()
+        print("Error during database migration: ", e)
+    finally:
+        conn.close()
 
-        # Create the blood sugar log table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS blood_sugar_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                glucose_value REAL NOT NULL,
-                alert_type TEXT,
-                log_type TEXT,
-                notes TEXT
-            )
-        """)
-
-        # Create insulin doses table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS insulin_doses(
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                dosage_amount REAL NOT NULL,
-                dosage_type TEXT,
-                entry_type TEXT,
-                carbs REAL,
-                related_log_id INTEGER,
-                FOREIGN KEY(related_log_id) REFERENCES blood_sugar_log(id)
-            )
-        """)
 
+def setup_database(db_file=None):
+    '''
+    Sets up the database by creating tables if they do not exist, migrating older schemas first.
+
+    :param db_file: Path to the SQLite database, defaults to DB_FILE.
+    '''
+    db_file = db_file or DB_FILE
+    conn = setup_connection(db_file)
+    if conn is None:
+        print("Unable to connect to SQLite database.")
+        return
+    try:
+        cur = conn.cursor()
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        needs_migration = version < SCHEMA_VERSION and table_columns(cur, "blood_sugar_log")
+    finally:
+        conn.close()
+
+    if needs_migration:
+        migrate_database(db_file)
+        return
+    if version == SCHEMA_VERSION:
+        # Already set up; skipping the write keeps the file unchanged, e.g. the tracked sample database
+        return
+
+    conn = setup_connection(db_file)
+    try:
+        cur = conn.cursor()
+        create_schema(cur)
         conn.commit()  # Save changes
     except Error as e:
         print("Error during database setup: ", e)
@@ -72,14 +377,32 @@ def execute_query(query, params = ()):
     :param params: Tuple of parameters to pass to SQL query
     '''
     try:
-        con = setup_connection(DB_FILE)
-        cur = con.cursor()
-        cur.execute(query, params)
-        con.commit()
+        with transaction() as con:
+            con.execute(query, params)
     except sqlite3.Error as e:
+        # Errors inside a caller's transaction must reach it so it can roll back
+        if getattr(_local, 'depth', 0):
+            raise
         print("Database query error: ",e)
-    finally:
-        con.close()
+
+
+def execute_many(query, rows):
+    '''
+    Execute SQL query once per parameter tuple inside a single transaction.
+
+    :param query: SQL query string to execute.
+    :param rows: Iterable of parameter tuples.
+    :return: Number of rows affected, or 0 on failure.
+    '''
+    try:
+        with transaction() as con:
+            cur = con.executemany(query, rows)
+        return cur.rowcount
+    except sqlite3.Error as e:
+        if getattr(_local, 'depth', 0):
+            raise
+        print("Database query error: ",e)
+        return 0
 
 
 def fetch_all_data(query, params = ()):
@@ -91,53 +414,404 @@ def fetch_all_data(query, params = ()):
     :return: List of tuples containing query result.
     '''
     try:
-        con = setup_connection(DB_FILE)
-        cur = con.cursor()
-        cur.execute(query, params).fetchall()
-
+        return get_connection().execute(query, params).fetchall()
     except sqlite3.Error as e:
         print("Error fetching data from database: ", e)
         return []
-    finally:
-        con.close()
 
 
 
-def log_data(timestamp, glucose_value, alert_type=None, log_type=None,notes=None):
+def log_data(timestamp, glucose_value, alert_type=None, log_type=None,notes=None, patient_id=None):
     '''
     Logs blood sugar measurements into the database.
 
-    :param timestamp: Time of the log entry.
+    :param timestamp: Time of the log entry (datetime, timestamp string or epoch seconds).
     :param glucose_value: Blood glucose in mmol/L
     :param alert_type: Type of alert (e.g., High, Low, null)
     :param log_type: Type of log (e.g., Reading, Alert)
     :param notes: Additional notes for the log entry.
+    :param patient_id: LibreLinkUp patient ID the reading belongs to.
+    '''
+    try:
+        count = write_readings([(to_epoch(timestamp), glucose_value, alert_type, log_type, notes, patient_id)])
+    except sqlite3.Error as e:
+        if getattr(_local, 'depth', 0):
+            raise
+        print("Database query error: ",e)
+        return
+
+    if not count:
+        print("Skipped duplicate reading:", patient_id, timestamp)
+        return
+    print("Logged data:",patient_id,timestamp,glucose_value,alert_type,log_type,notes)
+
+
+# Field order of bulk blood sugar and insulin records
+BLOOD_SUGAR_FIELDS = ('timestamp', 'glucose_value', 'alert_type', 'log_type', 'notes', 'patient_id')
+INSULIN_FIELDS = ('timestamp', 'dosage_amount', 'dosage_type', 'entry_type', 'carbs', 'related_log_id')
+
+
+def record_to_row(record, fields):
+    '''
+    Converts a record to a parameter tuple with its timestamp in epoch seconds.
+
+    :param record: Dictionary keyed by field name, or a sequence in field order
+                   (missing trailing fields are None).
+    :param fields: Field names in insert order, starting with timestamp.
+    :return: Tuple of parameters.
+    '''
+    if isinstance(record, dict):
+        values = [record.get(field) for field in fields]
+    else:
+        values = list(record) + [None] * (len(fields) - len(record))
+    values[0] = to_epoch(values[0])
+    return tuple(values)
+
+
+def get_range_thresholds(patient_id=None):
+    '''
+    Reads the target range used for a patient's in-range counts in the stats tables.
+
+    The range comes from the same per-patient profile as the readings' alert_type.
+
+    :param patient_id: LibreLinkUp patient ID, or None for the default profile.
+    :return: Tuple of (low threshold, high threshold) in mmol/L.
+    '''
+    thresholds = get_thresholds(patient_id or None)
+    return thresholds.low, thresholds.high
+
+
+def update_stats(conn, rows):
+    '''
+    Adds newly inserted readings to the daily_stats and hourly_stats aggregates.
+
+    :param conn: Connection with an open transaction.
+    :param rows: Blood sugar rows in BLOOD_SUGAR_FIELDS order with epoch timestamps.
+    '''
+    ranges = {}
+    period_keys = {
+        'daily_stats': lambda timestamp: from_epoch(timestamp).strftime('%Y-%m-%d'),
+        'hourly_stats': lambda timestamp: timestamp - timestamp % 3600,
+    }
+
+    for table, (period, _) in STATS_PERIODS.items():
+        aggregates = {}
+        for timestamp, glucose_value, alert_type, _, _, patient_id in rows:
+            if patient_id not in ranges:
+                ranges[patient_id] = get_range_thresholds(patient_id)
+            low, high = ranges[patient_id]
+            key = (patient_id or '', period_keys[table](timestamp))
+            count, total, in_range, highs, lows, minimum, maximum = aggregates.get(
+                key, (0, 0.0, 0, 0, 0, glucose_value, glucose_value))
+            aggregates[key] = (
+                count + 1,
+                total + glucose_value,
+                in_range + (low <= glucose_value <= high),
+                highs + (alert_type == 'High'),
+                lows + (alert_type == 'Low'),
+                min(minimum, glucose_value),
+                max(maximum, glucose_value),
+            )
+
+        period_column = period.split()[0]
+        conn.executemany(f"""
+        INSERT INTO {table}(patient_id, {period_column}, reading_count, glucose_sum, in_range_count,
+                            high_count, low_count, min_glucose, max_glucose)
+        VALUES (?,?,?,?,?,?,?,?,?)
+        ON CONFLICT(patient_id, {period_column}) DO UPDATE SET
+            reading_count = reading_count + excluded.reading_count,
+            glucose_sum = glucose_sum + excluded.glucose_sum,
+            in_range_count = in_range_count + excluded.in_range_count,
+            high_count = high_count + excluded.high_count,
+            low_count = low_count + excluded.low_count,
+            min_glucose = MIN(min_glucose, excluded.min_glucose),
+            max_glucose = MAX(max_glucose, excluded.max_glucose)
+        """, [key + values for key, values in aggregates.items()])
+
+
+def rebuild_stats(cur=None):
     '''
+    Recomputes the daily_stats and hourly_stats tables from every stored reading,
+    e.g. after the thresholds change.
+
+    :param cur: Cursor with an open transaction, or None to use a new transaction.
+    '''
+    if cur is None:
+        with transaction() as conn:
+            rebuild_stats(conn.cursor())
+        return
+
+    # Target range of each patient in the log, joined in as a VALUES table
+    ranges = [(patient_id,) + get_range_thresholds(patient_id) for (patient_id,) in
+              cur.execute("SELECT DISTINCT COALESCE(patient_id, '') FROM blood_sugar_log").fetchall()]
+    for table, (period, expression) in STATS_PERIODS.items():
+        period_column = period.split()[0]
+        cur.execute(f"DELETE FROM {table}")
+        if not ranges:
+            continue
+        cur.execute(f"""
+        WITH ranges(patient_id, low, high) AS (VALUES {', '.join(['(?,?,?)'] * len(ranges))})
+        INSERT INTO {table}(patient_id, {period_column}, reading_count, glucose_sum, in_range_count,
+                            high_count, low_count, min_glucose, max_glucose)
+        SELECT COALESCE(b.patient_id, ''), {expression}, COUNT(*), SUM(glucose_value),
+               SUM(glucose_value BETWEEN r.low AND r.high), SUM(alert_type IS 'High'), SUM(alert_type IS 'Low'),
+               MIN(glucose_value), MAX(glucose_value)
+        FROM blood_sugar_log AS b JOIN ranges AS r ON r.patient_id = COALESCE(b.patient_id, '')
+        GROUP BY 1, 2
+        """, [value for row in ranges for value in row])
+
+
+def write_readings(rows):
+    '''
+    Inserts blood sugar rows and updates the aggregate tables in one transaction.
+
+    Rows for a patient and time that is already logged are skipped and not counted in the aggregates.
+
+    :param rows: Blood sugar rows in BLOOD_SUGAR_FIELDS order with epoch timestamps.
+    :return: Number of rows inserted.
+    '''
+    timestamps = {}
+    for row in rows:
+        timestamps.setdefault(row[5], []).append(row[0])
+
+    with transaction() as con:
+        # One indexed range query per patient finds the times already logged
+        logged = set()
+        for patient_id, times in timestamps.items():
+            logged.update((patient_id, timestamp) for (timestamp,) in con.execute(
+                "SELECT timestamp FROM blood_sugar_log WHERE patient_id IS ? AND timestamp BETWEEN ? AND ?",
+                (patient_id, min(times), max(times))))
+
+        inserted = []
+        for row in rows:
+            if (row[5], row[0]) not in logged:
+                logged.add((row[5], row[0]))
+                inserted.append(row)
+
+        con.executemany("""
+        INSERT INTO blood_sugar_log(timestamp, glucose_value, alert_type, log_type, notes, patient_id)
+        VALUES (?,?,?,?,?,?)
+        """, inserted)
+        update_stats(con, inserted)
+    return len(inserted)
+
+
+def log_many(records):
+    '''
+    Logs many blood sugar measurements in a single transaction.
+
+    :param records: Iterable of records with the fields of log_data
+                    (timestamp, glucose_value, alert_type, log_type, notes, patient_id).
+    :return: Number of rows inserted.
+    '''
+    rows = [record_to_row(record, BLOOD_SUGAR_FIELDS) for record in records]
+    if not rows:
+        return 0
+    try:
+        count = write_readings(rows)
+    except sqlite3.Error as e:
+        if getattr(_local, 'depth', 0):
+            raise
+        print("Database query error: ",e)
+        return 0
+    print(f"Logged {count} blood sugar records")
+    return count
+
+
+def log_insulin_many(records):
+    '''
+    Logs many insulin doses in a single transaction.
+
+    :param records: Iterable of records with the fields
+                    (timestamp, dosage_amount, dosage_type, entry_type, carbs, related_log_id).
+    :return: Number of rows inserted.
+    '''
+    rows = [record_to_row(record, INSULIN_FIELDS) for record in records]
+    if not rows:
+        return 0
     query = ("""
-    INSERT INTO blood_sugar_log(timestamp, glucose_value, alert_type,log_type ,notes)
-    VALUES (?,?,?,?,?)
+    INSERT INTO insulin_doses(timestamp, dosage_amount, dosage_type, entry_type, carbs, related_log_id)
+    VALUES (?,?,?,?,?,?)
     """)
+    count = execute_many(query, rows)
+    print(f"Logged {count} insulin dose records")
+    return count
 
-    execute_query(query, (timestamp, glucose_value, alert_type,log_type, notes))
 
-    print("Logged data:",timestamp,glucose_value,alert_type,log_type,notes)
+class BufferedWriter:
+    '''
+    Buffers blood sugar and insulin records and writes them in bulk.
+
+    The buffer is flushed as soon as it holds max_rows records, and a background
+    thread flushes whatever is pending every max_delay seconds.
+    '''
 
-def find_closest_blood_sugar_log(timestamp):
+    def __init__(self, max_rows=500, max_delay=5.0):
+        '''
+        :param max_rows: Number of buffered records that triggers a flush.
+        :param max_delay: Seconds between background flushes.
+        '''
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.readings = []
+        self.doses = []
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._flush_periodically, name="buffered-writer", daemon=True)
+        self.thread.start()
+
+    def add_reading(self, record):
+        '''
+        Buffers a blood sugar record (see log_many).
+
+        :param record: Blood sugar record.
+        '''
+        with self.lock:
+            self.readings.append(record)
+            full = len(self.readings) + len(self.doses) >= self.max_rows
+        if full:
+            self.flush()
+
+    def add_dose(self, record):
+        '''
+        Buffers an insulin dose record (see log_insulin_many).
+
+        :param record: Insulin dose record.
+        '''
+        with self.lock:
+            self.doses.append(record)
+            full = len(self.readings) + len(self.doses) >= self.max_rows
+        if full:
+            self.flush()
+
+    def _flush_periodically(self):
+        """Flushes pending records every max_delay seconds until the writer is closed."""
+        while not self.closed.wait(self.max_delay):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print("Error flushing buffered records: ", e)
+
+    def flush(self):
+        '''
+        Writes every buffered record in one transaction.
+
+        If the write fails the records stay buffered for the next flush and the error is raised.
+
+        :return: Number of records written.
+        '''
+        with self.lock:
+            readings, self.readings = self.readings, []
+            doses, self.doses = self.doses, []
+        if not readings and not doses:
+            return 0
+        try:
+            with transaction():
+                return log_many(readings) + log_insulin_many(doses)
+        except Exception:
+            # The transaction rolled back, so put the records back ahead of any added meanwhile
+            with self.lock:
+                self.readings[:0] = readings
+                self.doses[:0] = doses
+            raise
+
+    def close(self):
+        """Stops the background thread and flushes any remaining records."""
+        self.closed.set()
+        self.thread.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def find_closest_blood_sugar_log(timestamp, patient_id=None):
     '''
     Finds the closest blood sugar log entry to the given timestamp.
 
+    Uses two seeks on the timestamp index, one for the first entry at or after the
+    time and one for the last entry before it, so the cost does not grow with the table.
+
     :param timestamp: Time to find the closest log entry to.
+    :param patient_id: Only consider entries for this patient.
     :return: Tuple of the closest log entry or None if no log entry exists.
     '''
-    query = ("""
-    SELECT id, timestamp, glucose_value
-    FROM blood_sugar_log
-    ORDER BY ABS(strftime('%s',timestamp) - strftime('%s',?)) ASC
-    LIMIT 1;
-    """)
-    result = fetch_all_data(query,(timestamp,))
-    if result is None:
-        return result[0]
+    target = to_epoch(timestamp)
+    patient_filter = "" if patient_id is None else "AND patient_id = ?"
+    params = (target,) if patient_id is None else (target, patient_id)
+
+    after = fetch_all_data(f"""
+    SELECT id, timestamp, glucose_value FROM blood_sugar_log
+    WHERE timestamp >= ? {patient_filter}
+    ORDER BY timestamp ASC LIMIT 1
+    """, params)
+    before = fetch_all_data(f"""
+    SELECT id, timestamp, glucose_value FROM blood_sugar_log
+    WHERE timestamp < ? {patient_filter}
+    ORDER BY timestamp DESC LIMIT 1
+    """, params)
+
+    candidates = after + before
+    if not candidates:
+        return None
+    return min(candidates, key=lambda row: abs(row[1] - target))
+
+
+def find_closest_blood_sugar_logs(timestamps, patient_id=None):
+    '''
+    Finds the closest blood sugar log entry for each of many timestamps in one pass.
+
+    The entries spanning the requested times are read in a single ordered range query
+    and each timestamp is matched by binary search.
+
+    :param timestamps: Iterable of times to find the closest log entries to.
+    :param patient_id: Only consider entries for this patient.
+    :return: List of closest log entry tuples (or None) in the order of timestamps.
+    '''
+    targets = [to_epoch(timestamp) for timestamp in timestamps]
+    if not targets:
+        return []
+
+    # Widen the range to the neighbours just outside the earliest and latest targets
+    lower = find_closest_blood_sugar_log(min(targets), patient_id)
+    upper = find_closest_blood_sugar_log(max(targets), patient_id)
+    if lower is None:
+        return [None] * len(targets)
+    start = min(lower[1], min(targets))
+    end = max(upper[1], max(targets))
+
+    patient_filter = "" if patient_id is None else "AND patient_id = ?"
+    params = (start, end) if patient_id is None else (start, end, patient_id)
+    rows = fetch_all_data(f"""
+    SELECT id, timestamp, glucose_value FROM blood_sugar_log
+    WHERE timestamp BETWEEN ? AND ? {patient_filter}
+    ORDER BY timestamp
+    """, params)
+    times = [row[1] for row in rows]
+
+    closest = []
+    for target in targets:
+        position = bisect.bisect_left(times, target)
+        candidates = rows[max(position - 1, 0):position + 1]
+        closest.append(min(candidates, key=lambda row: abs(row[1] - target)))
+    return closest
+
+
+def link_insulin_doses():
+    '''
+    Links every insulin dose without a related log to its closest blood sugar log entry.
+
+    :return: Number of doses linked.
+    '''
+    doses = fetch_all_data("SELECT id, timestamp FROM insulin_doses WHERE related_log_id IS NULL ORDER BY timestamp")
+    closest = find_closest_blood_sugar_logs([dose[1] for dose in doses])
+    updates = [(log[0], dose[0]) for dose, log in zip(doses, closest) if log is not None]
+    if updates:
+        execute_many("UPDATE insulin_doses SET related_log_id = ? WHERE id = ?", updates)
+    return len(updates)
 
 
 def fetch_insulin_doses():
@@ -162,4 +836,12 @@ def fetch_blood_sugar_logs():
 
 
 if __name__ == "__main__":
-    setup_database()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        migrate_database(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif len(sys.argv) > 1 and sys.argv[1] == "rebuild-stats":
+        rebuild_stats()
+        print("Rebuilt daily and hourly stats.")
+    elif len(sys.argv) > 1 and sys.argv[1] == "link-doses":
+        print(f"Linked {link_insulin_doses()} insulin doses to blood sugar logs.")
+    else:
+        setup_database()
\ No newline at end of file
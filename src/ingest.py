@@ -0,0 +1,74 @@
+# ingest.py
+from analysis import classify_level, get_thresholds
+from database import fetch_all_data, log_many
+from instrumentation import increment, timed
+from utils import to_epoch
+
+
+def extract_measurements(cgm_data):
+    """
+    Collects every measurement in a /graph payload, including the graphData history.
+
+    :param cgm_data: Dictionary returned by the /graph endpoint.
+    :return: Dictionary of epoch timestamp to measurement dictionary.
+    """
+    measurements = list(cgm_data.get("graphData") or [])
+    latest_measurement = (cgm_data.get("connection") or {}).get("glucoseMeasurement")
+    if latest_measurement:
+        measurements.append(latest_measurement)
+
+    unique = {}
+    for measurement in measurements:
+        if measurement.get("Timestamp") is not None and measurement.get("Value") is not None:
+            unique[to_epoch(measurement["Timestamp"])] = measurement
+    return unique
+
+
+# Alert type stored in blood_sugar_log for each glucose level from classify_level
+ALERT_TYPES = {"EXTREMELY low": "Low", "Low": "Low", "High": "High", "EXTREMELY high": "High"}
+
+
+def ingest_cgm_data(cgm_data, patient_id, measurements=None, since=None):
+    """
+    Stores every measurement in a /graph payload that is not already logged for the patient.
+
+    New readings are written in one transaction, so a single poll backfills any gap
+    covered by the payload's history.
+
+    :param cgm_data: Dictionary returned by the /graph endpoint.
+    :param patient_id: LibreLinkUp patient ID.
+    :param measurements: Result of extract_measurements for the payload, if already computed.
+    :param since: Epoch timestamp of the latest measurement already processed for the patient;
+                  later readings that are already logged are counted as duplicates.
+    :return: Number of new readings stored.
+    """
+    if measurements is None:
+        measurements = extract_measurements(cgm_data)
+    if not measurements:
+        return 0
+
+    existing = {row[0] for row in fetch_all_data(
+        "SELECT timestamp FROM blood_sugar_log WHERE patient_id = ? AND timestamp BETWEEN ? AND ?",
+        (patient_id, min(measurements), max(measurements)))}
+
+    new_measurements = [(timestamp, measurement["Value"])
+                        for timestamp, measurement in sorted(measurements.items())
+                        if timestamp not in existing]
+    # The history before the last processed measurement is expected to be logged already
+    if since is not None:
+        increment("duplicate_readings", patient_id, sum(timestamp > since for timestamp in existing))
+    if not new_measurements:
+        return 0
+
+    with timed("classify", patient_id):
+        # A poll holds at most a few hours of readings, so plain Python keeps NumPy out of the monitor
+        thresholds = get_thresholds(patient_id)
+        levels = [classify_level(value, thresholds) for _, value in new_measurements]
+        records = [
+            (timestamp, value, ALERT_TYPES.get(level), "Reading", None, patient_id)
+            for (timestamp, value), level in zip(new_measurements, levels)
+        ]
+    with timed("db_write", patient_id):
+        count = log_many(records)
+    increment("readings", patient_id, count)
+    return count
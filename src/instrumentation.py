@@ -0,0 +1,280 @@
+# instrumentation.py
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import sys
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Prefix of every exported metric name
+METRIC_PREFIX = 'diacomp'
+
+# Counters by name and their help text; counts are labelled by patient_id where known and any further labels
+COUNTERS = {
+    'polls': "Patient polls started.",
+    'unchanged_polls': "Polls whose payload was already processed.",
+    'readings': "New readings stored.",
+    'duplicate_readings': "Readings newer than the last processed measurement that were already logged.",
+    'alerts': "Alerts queued, by alert type.",
+    'errors': "Failures, by stage.",
+    'sms_sent': "SMS messages sent.",
+    'sms_failures': "SMS messages dropped after every retry failed.",
+}
+
+# Structured log events are written to this logger as JSON lines
+logger = logging.getLogger('diacomp')
+
+
+class Histogram:
+    """
+    Cumulative latency histogram in the Prometheus bucket layout.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: Sorted bucket upper bounds in seconds; +Inf is added.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        """
+        Records one duration.
+
+        :param seconds: Duration in seconds.
+        """
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Returns the number of observations at or below each bucket bound.
+
+        :return: List of (upper bound text, count) tuples ending with +Inf.
+        """
+        total = 0
+        rows = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            rows.append(('+Inf' if bound == float('inf') else repr(bound), total))
+        return rows
+
+
+def format_labels(labels):
+    """
+    Formats labels for the Prometheus text format.
+
+    :param labels: Tuple of (name, value) pairs.
+    :return: Label text including the braces, or an empty string without labels.
+    """
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class MetricsRegistry:
+    """
+    Thread-safe stage latency histograms and per-patient counters.
+    """
+
+    def __init__(self):
+        self.histograms = {}  # Stage name to Histogram
+        self.counters = {}  # (counter name, labels) to count
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        """
+        Records the duration of a stage.
+
+        :param stage: Stage name (e.g., "graph_fetch").
+        :param seconds: Duration in seconds.
+        """
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, patient_id=None, amount=1, **labels):
+        """
+        Adds to a counter.
+
+        :param name: Counter name, one of COUNTERS.
+        :param patient_id: Patient the event belongs to, if any.
+        :param amount: Amount to add.
+        :param labels: Further labels (e.g., alert_type="low").
+        """
+        if name not in COUNTERS:
+            raise ValueError(f"Unknown counter '{name}'. Choose from: {', '.join(COUNTERS)}")
+        if not amount:
+            return
+        if patient_id is not None:
+            labels['patient_id'] = patient_id
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        :return: Metrics text.
+        """
+        lines = []
+        with self.lock:
+            name = f"{METRIC_PREFIX}_stage_duration_seconds"
+            lines.append(f"# HELP {name} Duration of each monitoring stage.")
+            lines.append(f"# TYPE {name} histogram")
+            for stage, histogram in sorted(self.histograms.items()):
+                for bound, count in histogram.cumulative():
+                    lines.append(f"{name}_bucket{format_labels((('stage', stage), ('le', bound)))} {count}")
+                lines.append(f"{name}_sum{format_labels((('stage', stage),))} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels((('stage', stage),))} {histogram.count}")
+
+            for counter, help_text in COUNTERS.items():
+                name = f"{METRIC_PREFIX}_{counter}_total"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for (key_name, labels), count in sorted(self.counters.items()):
+                    if key_name == counter:
+                        lines.append(f"{name}{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Clears every metric."""
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+# Shared registry of the process
+registry = MetricsRegistry()
+
+
+def increment(name, patient_id=None, amount=1, **labels):
+    """
+    Adds to a counter of the shared registry.
+
+    :param name: Counter name, one of COUNTERS.
+    :param patient_id: Patient the event belongs to, if any.
+    :param amount: Amount to add.
+    :param labels: Further labels (e.g., alert_type="low").
+    """
+    registry.increment(name, patient_id, amount, **labels)
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """
+    Writes a structured log event.
+
+    :param event: Event name (e.g., "stage").
+    :param level: Logging level.
+    :param fields: Fields of the event.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+
+@contextmanager
+def timed(stage, patient_id=None):
+    """
+    Times a block as a monitoring stage.
+
+    The duration is recorded in the stage's histogram and logged at DEBUG level;
+    an exception is counted as an error of the stage, logged and re-raised.
+
+    :param stage: Stage name (e.g., "graph_fetch").
+    :param patient_id: Patient the stage runs for, if any.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        seconds = time.perf_counter() - started
+        registry.observe(stage, seconds)
+        increment('errors', patient_id, stage=stage)
+        log_event('stage', logging.WARNING, stage=stage, patient_id=patient_id, seconds=round(seconds, 6),
+                  outcome='error', error=str(e))
+        raise
+    seconds = time.perf_counter() - started
+    registry.observe(stage, seconds)
+    log_event('stage', logging.DEBUG, stage=stage, patient_id=patient_id, seconds=round(seconds, 6), outcome='ok')
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as one JSON object per line.
+    """
+
+    def format(self, record):
+        document = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'event': record.getMessage(),
+            **getattr(record, 'fields', {}),
+        }
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+def configure_logging(level='WARNING', stream=None):
+    """
+    Writes structured log events at or above a level as JSON lines.
+
+    :param level: Logging level name or number (e.g., "DEBUG" to log every stage timing).
+    :param stream: Stream to write to, defaults to stderr.
+    """
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger.handlers[:] = [handler]
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the shared registry at /metrics.
+    """
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are frequent; keep them out of the output
+        pass
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """
+    Serves the metrics endpoint from a background thread.
+
+    :param port: Port to listen on; 0 picks a free port.
+    :param host: Address to listen on, local only by default.
+    :return: The running ThreadingHTTPServer; call shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
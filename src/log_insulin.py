@@ -1,6 +1,7 @@
 import sqlite3
 from datetime import datetime
 from database import find_closest_blood_sugar_log, execute_query
+from utils import to_epoch, from_epoch
 
 DB_FILE = 'blood_sugar_data.db'
 
@@ -41,12 +42,25 @@ def log_insulin_dose():
         print("Invalid input for carbs. Please enter a valid number.")
         return
 
+    record_insulin_dose(timestamp, dosage_amount, dosage_type, entry_type, carbs)
+
+
+def record_insulin_dose(timestamp, dosage_amount, dosage_type=None, entry_type=None, carbs=None):
+    '''
+    Stores an insulin dose linked to the closest blood sugar log.
+
+    :param timestamp: Time of the dose (datetime, timestamp string or epoch seconds).
+    :param dosage_amount: Insulin units.
+    :param dosage_type: Insulin type (e.g., rapid-acting or long-acting insulin).
+    :param entry_type: Type of entry (e.g., Correction, Meal, Snack, or Other).
+    :param carbs: Carbs in grams, or None.
+    '''
     # Finds the closest blood sugar log
     closest_log = find_closest_blood_sugar_log(timestamp)
     if closest_log:
         related_log_id, related_log_time, related_glucose = closest_log
         print(f"Linking to the closest blood sugar log: ID {related_log_id}, "
-              f"Time: {related_log_time}, Glucose: {related_glucose} mmol/L.")
+              f"Time: {from_epoch(related_log_time)}, Glucose: {related_glucose} mmol/L.")
     else:
         print("No blood sugar logs found. Proceeding without linking.")
         related_log_id = None
@@ -58,7 +72,7 @@ def log_insulin_dose():
     VALUES (?, ?, ?, ?, ?, ?)
     """)
 
-    execute_query(query, (timestamp, dosage_amount, dosage_type, entry_type, carbs, related_log_id))
+    execute_query(query, (to_epoch(timestamp), dosage_amount, dosage_type, entry_type, carbs, related_log_id))
     print(f"Insulin dosage logged: {dosage_amount} units ({dosage_type}) at {timestamp}.")
 
 
@@ -1,154 +1,123 @@
-from api import login, get_patient_id, get_cgm_data
-from dotenv import load_dotenv
-from analysis import is_low_blood_sugar, is_high_blood_sugar, is_extremely_low, is_extremely_high, is_normal_level
-from send_sms import send_sms
-from apscheduler.schedulers.background import BackgroundScheduler, BlockingScheduler
 import time
-from datetime import datetime, timedelta
+
+# Taken before the other imports so the startup time includes them
+STARTED = time.perf_counter()
+
+from api import LibreLinkUpSession
+from dotenv import load_dotenv
+from monitor import MonitoringEngine
+from analysis import install_reload_handler
+from apscheduler.schedulers.background import BackgroundScheduler
 import os
-from database import log_data
+import sys
+from database import setup_database
+from instrumentation import configure_logging, start_metrics_server
 
+# Startup budget of the monitor: seconds from process start until the scheduler runs and peak memory in MB
+STARTUP_BUDGET = float(os.getenv("MONITOR_STARTUP_BUDGET", 1.0))
+RSS_BUDGET_MB = float(os.getenv("MONITOR_RSS_BUDGET_MB", 64))
 
-# Global variables for tracking alert timing
-last_low_alert_time= None
-last_high_alert_time = None
-last_extreme_low_alert_time = None
-last_extreme_high_alert_time = None
+# Analytics libraries the monitor must never import
+ANALYTICS_MODULES = ('numpy', 'pandas', 'matplotlib', 'mplcursors', 'pyarrow')
 
 
-def send_alert(condition, user_name, timestamp, blood_sugar, suggested_action):
+def peak_rss_mb():
     """
-    Send an SMS alert for a specific condition.
+    Returns the peak resident memory of this process.
 
-    :param condition: Description of the blood sugar (e.g., "low or high")
-    :param user_name: Name of the user being monitored
-    :param timestamp: Time of blood sugar reading.
-    :param blood_sugar: Blood sugar reading value.
-    :param suggested_action: Recommended action to be taken.
+    :return: Peak RSS in MB, or None where the resource module is unavailable.
     """
     try:
-        msg = (
-            f"Time: {timestamp}\n"
-            f"Alert! {user_name}'s blood glucose is {condition}! Glucose Reading: {blood_sugar}\n"
-            f"Suggested Action: {suggested_action}"
-        )
-        send_sms(msg)
-    except Exception as e:
-        print("Failed to send SMS alert: ", e)
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
 
+def check_startup():
+    """
+    Measures the startup time and memory of the monitor against its budget.
 
-def monitor_blood_sugar():
+    :return: List of budget violations, empty when within budget.
     """
-    Monitor blood sugar levels and send alerts based on conditions.
+    elapsed = time.perf_counter() - STARTED
+    rss = peak_rss_mb()
+    loaded = [name for name in ANALYTICS_MODULES if name in sys.modules]
+
+    print(f"Started in {elapsed:.3f}s (budget {STARTUP_BUDGET:.3f}s)"
+          + (f", peak RSS {rss:.1f} MB (budget {RSS_BUDGET_MB:.0f} MB)" if rss is not None else ""))
+
+    problems = []
+    if elapsed > STARTUP_BUDGET:
+        problems.append(f"startup took {elapsed:.3f}s, over the {STARTUP_BUDGET:.3f}s budget")
+    if rss is not None and rss > RSS_BUDGET_MB:
+        problems.append(f"peak RSS is {rss:.1f} MB, over the {RSS_BUDGET_MB:.0f} MB budget")
+    if loaded:
+        problems.append(f"analytics modules imported: {', '.join(loaded)}")
+    for problem in problems:
+        print(f"Warning: {problem}")
+    return problems
+
+
+def create_engine():
     """
-    global last_low_alert_time, last_high_alert_time, last_extreme_low_alert_time, \
-        last_extreme_high_alert_time, last_extreme_low_alert_time
+    Sets up the database and creates the monitoring engine.
 
+    :return: MonitoringEngine instance.
+    """
     # Load environment variables
     load_dotenv(dotenv_path='../login.env')
     email = os.getenv('EMAIL')
     password = os.getenv('PASSWORD')
-    user_name = os.getenv('USER_NAME')
 
-    try:
-        # Login and get token
-        token = login(email, password)
-
-        # Get connections and retrieve patient ID
-        patient_id = get_patient_id(token)
-
-
-        # Get CGM data
-        cgm_data = get_cgm_data(token, patient_id)
-        latest_measurement = cgm_data["connection"]["glucoseMeasurement"]
-
-        timestamp = latest_measurement["Timestamp"]
-        blood_sugar = latest_measurement["Value"]
-
-        # Handling extreme lows
-        if is_extremely_low(latest_measurement):
-            if last_extreme_low_alert_time is None or datetime.now() > last_extreme_low_alert_time + timedelta(minutes= 7):
-                send_alert(
-                    "EXTREMELY low",
-                    user_name,
-                    timestamp,
-                    blood_sugar,
-                    "Take immediate action! Drink juice and check again in 15 minutes.",
-                )
-                log_data(timestamp, blood_sugar, alert_type="EXTREMELY low", log_type="alert")
-                last_extreme_low_alert_time = datetime.now()
-
-
-        # Handling extreme highs
-        if is_extremely_high(latest_measurement):
-            if last_extreme_high_alert_time is None or datetime.now() > last_extreme_high_alert_time + timedelta(minutes= 30):
-                send_alert(
-                    "EXTREMELY high",
-                    user_name,
-                    timestamp,
-                    blood_sugar,
-                    "Take immediate corrective dosage and monitor closely.",
-                )
-                log_data(timestamp, blood_sugar, alert_type="EXTREMELY high", log_type="alert")
-                last_extreme_high_alert_time = datetime.now()
-
-        # Handle lows
-        if is_low_blood_sugar(latest_measurement):
-            if last_low_alert_time is None or datetime.now() > last_low_alert_time + timedelta(minutes=15):
-                send_alert(
-                    "low",
-                    user_name,
-                    timestamp,
-                    blood_sugar,
-                    "Drink juice and check blood sugar again in 15 minutes.",
-                )
-                log_data(timestamp, blood_sugar, alert_type="Low", log_type="alert")
-                last_low_alert_time = datetime.now()
-
-        # Handle highs
-        if is_high_blood_sugar(latest_measurement):
-            if last_high_alert_time is None or datetime.now() > last_high_alert_time + timedelta(minutes=30):
-                send_alert(
-                    "high",
-                    user_name,
-                    timestamp,
-                    blood_sugar,
-                    "Take a corrective dosage and monitor closely.",
-                )
-                log_data(timestamp, blood_sugar, alert_type="High", log_type="alert")
-                last_high_alert_time = datetime.now()
-
-        if is_normal_level(latest_measurement):
-            last_low_alert_time = None
-            last_high_alert_time = None
-            last_extreme_low_alert_time = None
-            last_extreme_high_alert_time = None
-            log_data(timestamp, blood_sugar, log_type="Reading")
-
-    except Exception as e:
-        print("Error monitoring blood sugar: ", e)
+    setup_database()
+    install_reload_handler()
+
+    workers = int(os.getenv("MONITOR_WORKERS", 16))
+    session = LibreLinkUpSession(email, password, pool_size=workers)
+    return MonitoringEngine(session, max_workers=workers)
+
 
 def main():
     """
     Function to start the blood sugar monitoring scheduler.
     """
+    # Structured JSON logs on stderr; LOG_LEVEL=DEBUG logs the timing of every stage
+    configure_logging(os.getenv("LOG_LEVEL", "WARNING"))
+    engine = create_engine()
+
+    metrics_server = None
+    if os.getenv("METRICS_PORT"):
+        metrics_server = start_metrics_server(int(os.getenv("METRICS_PORT")), os.getenv("METRICS_HOST", "127.0.0.1"))
+        print(f"Serving metrics at http://{metrics_server.server_address[0]}:{metrics_server.server_address[1]}/metrics")
 
     scheduler = BackgroundScheduler()
-    #Monitor_blood_sugar every 5 minutes
-    scheduler.add_job(monitor_blood_sugar, 'interval',
-                      minutes = int(os.getenv("MONITOR_INTERVAL",5))
+    #Check every few seconds which patients are due, each on their own adaptive interval
+    scheduler.add_job(engine.poll_due, 'interval',
+                      seconds = int(os.getenv("POLL_TICK", 10)),
+                      max_instances=1
                       )
 
     print("Scheduler started. Monitoring blood sugar levels...")
     scheduler.start()
+    check_startup()
 
     try:
         while True:
             time.sleep(1) # Keeps program running continously
     except (KeyboardInterrupt, SystemExit):
         scheduler.shutdown()
+        engine.shutdown()
+        if metrics_server is not None:
+            metrics_server.shutdown()
         print("Scheduler stopped.")
 
 
 if __name__ == "__main__":
+    if '--check-startup' in sys.argv[1:]:
+        # Start up without polling and exit non-zero when over budget, e.g. in CI or a container health check
+        create_engine().shutdown()
+        sys.exit(1 if check_startup() else 0)
     main()
@@ -0,0 +1,184 @@
+# metrics.py
+import numpy as np
+import pandas as pd
+from analysis import get_thresholds
+
+# Longest gap in minutes a reading is assumed to last; longer gaps count as missing data
+MAX_GAP_MINUTES = 15
+
+# mg/dL per mmol/L of glucose
+MGDL_PER_MMOL = 18.018
+
+
+def epoch_seconds(timestamps):
+    """
+    Converts timestamps to an array of epoch seconds.
+
+    :param timestamps: Series or array of datetimes, or of epoch seconds.
+    :return: float64 NumPy array.
+    """
+    timestamps = np.asarray(timestamps)
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        return timestamps.astype('datetime64[s]').astype('int64').astype('float64')
+    return timestamps.astype('float64')
+
+
+def interval_weights(times, max_gap=MAX_GAP_MINUTES):
+    """
+    Weights each reading by the minutes until the next one, capped at max_gap.
+
+    The last reading lasts as long as the median interval, so a lone reading still counts.
+
+    :param times: Sorted epoch seconds.
+    :param max_gap: Longest duration in minutes credited to one reading.
+    :return: Array of durations in minutes, one per reading.
+    """
+    times = np.asarray(times, dtype='float64')
+    if times.size == 0:
+        return np.empty(0)
+    durations = np.minimum(np.diff(times) / 60.0, max_gap)
+    last = np.median(durations) if durations.size else max_gap
+    return np.append(durations, last)
+
+
+def time_in_ranges(times, values, thresholds=None, max_gap=MAX_GAP_MINUTES):
+    """
+    Calculates the time-weighted percentage of time spent in each glucose range.
+
+    :param times: Sorted epoch seconds.
+    :param values: Glucose values in mmol/L.
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
+    :param max_gap: Longest duration in minutes credited to one reading.
+    :return: Dictionary of very_low, low, in_range, high and very_high percentages,
+             where low and high include the very low and very high time.
+    """
+    thresholds = thresholds or get_thresholds()
+    values = np.asarray(values, dtype='float64')
+    weights = interval_weights(times, max_gap)
+    total = weights.sum()
+    if total == 0:
+        return {'very_low': 0.0, 'low': 0.0, 'in_range': 0.0, 'high': 0.0, 'very_high': 0.0}
+
+    def percentage(mask):
+        return round(float(weights[mask].sum() / total * 100), 2)
+
+    return {
+        'very_low': percentage(values < thresholds.extremely_low),
+        'low': percentage(values < thresholds.low),
+        'in_range': percentage((values >= thresholds.low) & (values <= thresholds.high)),
+        'high': percentage(values > thresholds.high),
+        'very_high': percentage(values > thresholds.extremely_high),
+    }
+
+
+def glucose_management_indicator(mean_glucose):
+    """
+    Estimates HbA1c (GMI, %) from mean glucose.
+
+    :param mean_glucose: Mean glucose in mmol/L.
+    :return: GMI in %.
+    """
+    return 3.31 + 0.02392 * mean_glucose * MGDL_PER_MMOL
+
+
+def mean_amplitude_of_excursions(values):
+    """
+    Calculates MAGE: the mean rise or fall between consecutive turning points that exceeds one SD.
+
+    Turning points are found from sign changes of the differences in one pass, and every
+    excursion larger than the SD counts, rather than the original's manual peak pairing.
+
+    :param values: Glucose values in mmol/L in time order.
+    :return: MAGE in mmol/L, or NaN without such excursions.
+    """
+    values = np.asarray(values, dtype='float64')
+    if values.size < 3:
+        return float('nan')
+
+    # Drop flat steps so plateaus do not split an excursion
+    steps = np.diff(values)
+    moving = np.flatnonzero(steps)
+    if moving.size == 0:
+        return float('nan')
+    signs = np.sign(steps[moving])
+    turns = moving[np.flatnonzero(np.diff(signs))] + 1
+    extremes = values[np.concatenate(([0], turns, [values.size - 1]))]
+
+    amplitudes = np.abs(np.diff(extremes))
+    amplitudes = amplitudes[amplitudes > values.std()]
+    return float(amplitudes.mean()) if amplitudes.size else float('nan')
+
+
+def blood_glucose_risk_indices(values):
+    """
+    Calculates the Kovatchev low and high blood glucose indices (LBGI and HBGI).
+
+    :param values: Glucose values in mmol/L.
+    :return: Tuple of (LBGI, HBGI).
+    """
+    values = np.asarray(values, dtype='float64')
+    if values.size == 0:
+        return float('nan'), float('nan')
+    f = 1.509 * (np.log(np.maximum(values, 0.1) * MGDL_PER_MMOL) ** 1.084 - 5.381)
+    risk = 10 * f ** 2
+    return float(np.where(f < 0, risk, 0).mean()), float(np.where(f > 0, risk, 0).mean())
+
+
+def glycaemic_metrics(blood_sugar_data, thresholds=None, max_gap=MAX_GAP_MINUTES):
+    """
+    Calculates the glycaemic metrics of a blood sugar series.
+
+    Mean glucose, its SD and the time in ranges are weighted by each reading's duration
+    (see interval_weights); MAGE and the risk indices use the readings themselves.
+
+    :param blood_sugar_data: Blood sugar data table with timestamp and glucose_value.
+    :param thresholds: ThresholdProfile, defaults to the cached default profile.
+    :param max_gap: Longest duration in minutes credited to one reading.
+    :return: Dictionary of metric name to value.
+    """
+    if not blood_sugar_data['timestamp'].is_monotonic_increasing:
+        blood_sugar_data = blood_sugar_data.sort_values('timestamp')
+    times = epoch_seconds(blood_sugar_data['timestamp'])
+    # Rounding restores float32 readings to the values stored in the database
+    values = np.round(blood_sugar_data['glucose_value'].to_numpy(dtype='float64'), 5)
+    if values.size == 0:
+        return {}
+
+    weights = interval_weights(times, max_gap)
+    mean = float(np.average(values, weights=weights))
+    sd = float(np.sqrt(np.average((values - mean) ** 2, weights=weights)))
+    lbgi, hbgi = blood_glucose_risk_indices(values)
+    ranges = time_in_ranges(times, values, thresholds, max_gap)
+
+    return {
+        'readings': int(values.size),
+        'hours_covered': round(float(weights.sum() / 60), 1),
+        'mean_glucose': round(mean, 2),
+        'sd': round(sd, 2),
+        'cv': round(sd / mean * 100, 2),
+        'gmi': round(glucose_management_indicator(mean), 2),
+        'time_very_low': ranges['very_low'],
+        'time_below_range': ranges['low'],
+        'time_in_range': ranges['in_range'],
+        'time_above_range': ranges['high'],
+        'time_very_high': ranges['very_high'],
+        'mage': round(mean_amplitude_of_excursions(values), 2),
+        'lbgi': round(lbgi, 2),
+        'hbgi': round(hbgi, 2),
+    }
+
+
+def metrics_by_patient(blood_sugar_data, max_gap=MAX_GAP_MINUTES):
+    """
+    Calculates the glycaemic metrics of every patient, each with their own thresholds.
+
+    :param blood_sugar_data: Blood sugar data table with patient_id, timestamp and glucose_value.
+    :param max_gap: Longest duration in minutes credited to one reading.
+    :return: Data table with one row of metrics per patient.
+    """
+    rows = []
+    for patient_id, readings in blood_sugar_data.groupby('patient_id', observed=True, dropna=False, sort=True):
+        patient_id = None if pd.isna(patient_id) else patient_id
+        rows.append({'patient_id': patient_id,
+                     **glycaemic_metrics(readings, get_thresholds(patient_id), max_gap)})
+    return pd.DataFrame(rows)
@@ -0,0 +1,265 @@
+# monitor.py
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import threading
+import time
+from analysis import is_low_blood_sugar, is_high_blood_sugar, is_extremely_low, is_extremely_high, is_normal_level, \
+    get_thresholds
+from alert_store import AlertStateStore
+from database import close_connections
+from ingest import ingest_cgm_data, extract_measurements
+from instrumentation import increment, timed
+from polling import AdaptivePollPlanner
+from send_sms import get_dispatcher
+from trend import TrendDetector
+from utils import to_epoch
+
+# Alert rules in the order they are evaluated:
+# (alert key, check, condition text, cooldown in minutes, suggested action)
+ALERT_RULES = [
+    ("extreme_low", is_extremely_low, "EXTREMELY low", 7,
+     "Take immediate action! Drink juice and check again in 15 minutes."),
+    ("extreme_high", is_extremely_high, "EXTREMELY high", 30,
+     "Take immediate corrective dosage and monitor closely."),
+    ("low", is_low_blood_sugar, "low", 15,
+     "Drink juice and check blood sugar again in 15 minutes."),
+    ("high", is_high_blood_sugar, "high", 30,
+     "Take a corrective dosage and monitor closely."),
+]
+
+# Predicted low alert: cooldown in minutes and suggested action
+PREDICTED_LOW_COOLDOWN = 15
+PREDICTED_LOW_ACTION = "Have a snack and check blood sugar again in 15 minutes."
+
+
+def send_alert(condition, user_name, timestamp, blood_sugar, suggested_action, dispatcher=None):
+    """
+    Queue an SMS alert for a specific condition.
+
+    :param condition: Description of the blood sugar (e.g., "low or high")
+    :param user_name: Name of the user being monitored
+    :param timestamp: Time of blood sugar reading.
+    :param blood_sugar: Blood sugar reading value.
+    :param suggested_action: Recommended action to be taken.
+    :param dispatcher: AlertDispatcher to queue the alert on, defaults to the shared one.
+    """
+    try:
+        msg = (
+            f"Time: {timestamp}\n"
+            f"Alert! {user_name}'s blood glucose is {condition}! Glucose Reading: {blood_sugar}\n"
+            f"Suggested Action: {suggested_action}"
+        )
+        (dispatcher or get_dispatcher()).submit(msg)
+    except Exception as e:
+        print("Failed to queue SMS alert: ", e)
+
+
+class PatientAlertState:
+    """
+    Alert rate limits for a single monitored patient, persisted in an AlertStateStore.
+    """
+
+    def __init__(self, patient_id, user_name, store):
+        """
+        :param patient_id: LibreLinkUp patient ID.
+        :param user_name: Name used in alert messages.
+        :param store: AlertStateStore holding the patient's rate limits.
+        """
+        self.patient_id = patient_id
+        self.user_name = user_name
+        self.store = store
+        self.trend = TrendDetector(size=int(os.getenv("TREND_WINDOW", 12)))
+        self.next_poll_at = 0
+        self.last_measurement = None  # Latest glucoseMeasurement already processed
+        self.lock = threading.Lock()
+
+    def try_alert(self, alert_key, cooldown_minutes):
+        """
+        Takes the right to send an alert if its rate limit allows it.
+
+        :param alert_key: Alert type key (e.g., "low").
+        :param cooldown_minutes: Minimum minutes between alerts of this type.
+        :return: True if an alert may be sent.
+        """
+        return self.store.try_acquire(self.patient_id, alert_key, cooldown_minutes)
+
+    def reset(self):
+        """Clears the threshold alert rate limits once glucose is back in range."""
+        self.store.reset(self.patient_id, [rule[0] for rule in ALERT_RULES])
+
+
+class MonitoringEngine:
+    """
+    Monitors every LibreLinkUp connection concurrently through a bounded thread pool.
+    """
+
+    def __init__(self, session, max_workers=None, dispatcher=None, alert_store=None, planner=None):
+        """
+        :param session: Authenticated LibreLinkUpSession.
+        :param max_workers: Maximum number of concurrent patient fetches.
+        :param dispatcher: AlertDispatcher used to send alerts, defaults to the shared one.
+        :param alert_store: AlertStateStore holding alert rate limits, loaded from the database by default.
+        :param planner: AdaptivePollPlanner choosing each patient's next poll time.
+        """
+        self.session = session
+        self.planner = planner or AdaptivePollPlanner()
+        self.connections_refresh = int(os.getenv("CONNECTIONS_REFRESH", 900))
+        self.connections_refreshed_at = None
+        self.dispatcher = dispatcher or get_dispatcher()
+        if alert_store is None:
+            alert_store = AlertStateStore()
+            alert_store.load()
+        self.alert_store = alert_store
+        self.prediction_horizon = float(os.getenv("PREDICTED_LOW_MINUTES", 20))
+        self.max_workers = max_workers or int(os.getenv("MONITOR_WORKERS", 16))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="monitor")
+        self.patients = {}
+
+    def refresh_patients(self):
+        """
+        Loads every connection of the user, keeping existing alert state for known patients.
+
+        :return: Dictionary of patient ID to PatientAlertState.
+        """
+        patients = {}
+        for connection in self.session.get_connections():
+            patient_id = connection["patientId"]
+            state = self.patients.get(patient_id)
+            if state is None:
+                name = " ".join(filter(None, [connection.get("firstName"), connection.get("lastName")]))
+                state = PatientAlertState(patient_id, name or os.getenv("USER_NAME"), self.alert_store)
+            patients[patient_id] = state
+        self.patients = patients
+        self.connections_refreshed_at = time.monotonic()
+        return patients
+
+    def poll_patient(self, state):
+        """
+        Fetches one patient's CGM data, stores any readings not yet logged and sends due alerts.
+
+        Payloads whose latest measurement was already processed skip the database and alert work.
+
+        :param state: PatientAlertState of the patient to poll.
+        """
+        increment("polls", state.patient_id)
+        try:
+            with timed("poll", state.patient_id):
+                cgm_data = self.session.get_cgm_data(state.patient_id, conditional=state.last_measurement is not None)
+                latest_measurement = None if cgm_data is None else cgm_data["connection"]["glucoseMeasurement"]
+                # Conditional fetches only happen once a measurement was processed, so None means unchanged
+                if cgm_data is None or self.is_unchanged(state, latest_measurement):
+                    increment("unchanged_polls", state.patient_id)
+                    self.schedule_next_poll(state, state.last_measurement)
+                    return
+
+                measurements = extract_measurements(cgm_data)
+                since = None if state.last_measurement is None else to_epoch(state.last_measurement["Timestamp"])
+                ingest_cgm_data(cgm_data, state.patient_id, measurements, since)
+                with state.lock:
+                    for timestamp, measurement in sorted(measurements.items()):
+                        state.trend.add(timestamp, measurement["Value"])
+                self.evaluate_measurement(state, latest_measurement)
+                state.last_measurement = latest_measurement
+                self.schedule_next_poll(state, latest_measurement)
+        except Exception as e:
+            print(f"Error monitoring blood sugar for {state.user_name}: ", e)
+            state.next_poll_at = to_epoch(datetime.now()) + self.planner.default_interval
+
+    @staticmethod
+    def is_unchanged(state, measurement):
+        """
+        Checks whether a measurement is the one last processed for the patient.
+
+        :param state: PatientAlertState of the patient.
+        :param measurement: glucoseMeasurement dictionary from the API.
+        :return: True if its timestamp matches the last processed measurement.
+        """
+        return (state.last_measurement is not None
+                and to_epoch(measurement["Timestamp"]) == to_epoch(state.last_measurement["Timestamp"]))
+
+    def schedule_next_poll(self, state, measurement):
+        """
+        Sets when the patient is polled next from their latest reading and trend.
+
+        :param state: PatientAlertState of the patient.
+        :param measurement: glucoseMeasurement dictionary from the API.
+        """
+        # FactoryTimestamp is UTC, so it compares with our UTC clock whatever the timezone or clock
+        # of the patient's phone; the local Timestamp is only used when it is missing
+        if measurement.get("FactoryTimestamp"):
+            measurement_time, now = to_epoch(measurement["FactoryTimestamp"]), int(time.time())
+        else:
+            measurement_time, now = to_epoch(measurement["Timestamp"]), to_epoch(datetime.now())
+        next_poll = self.planner.next_poll(
+            measurement_time, measurement["Value"], state.trend.rate_of_change(),
+            get_thresholds(state.patient_id), now)
+        # poll_due compares with local wall-clock epochs
+        state.next_poll_at = to_epoch(datetime.now()) + (next_poll - now)
+
+    def evaluate_measurement(self, state, measurement):
+        """
+        Applies the alert rules to a measurement for one patient.
+
+        :param state: PatientAlertState of the patient.
+        :param measurement: glucoseMeasurement dictionary from the API.
+        """
+        timestamp = measurement["Timestamp"]
+        blood_sugar = measurement["Value"]
+        thresholds = get_thresholds(state.patient_id)
+
+        with state.lock:
+            for alert_key, check, condition, cooldown, action in ALERT_RULES:
+                if check(measurement, thresholds) and state.try_alert(alert_key, cooldown):
+                    send_alert(condition, state.user_name, timestamp, blood_sugar, action, self.dispatcher)
+                    increment("alerts", state.patient_id, alert_type=alert_key)
+
+            if not is_low_blood_sugar(measurement, thresholds):
+                self.check_predicted_low(state, timestamp, blood_sugar, thresholds)
+
+            if is_normal_level(measurement, thresholds):
+                state.reset()
+
+    def check_predicted_low(self, state, timestamp, blood_sugar, thresholds):
+        """
+        Sends a predicted low alert when the trend reaches the low threshold within the horizon.
+
+        :param state: PatientAlertState of the patient.
+        :param timestamp: Time of the latest reading.
+        :param blood_sugar: Latest glucose value.
+        :param thresholds: ThresholdProfile of the patient.
+        """
+        minutes = state.trend.minutes_until_below(thresholds.low)
+        if minutes is None or minutes > self.prediction_horizon:
+            return
+        if state.try_alert("predicted_low", PREDICTED_LOW_COOLDOWN):
+            send_alert(f"predicted to go low in {max(round(minutes), 1)} minutes", state.user_name,
+                       timestamp, blood_sugar, PREDICTED_LOW_ACTION, self.dispatcher)
+            increment("alerts", state.patient_id, alert_type="predicted_low")
+
+    def poll_due(self):
+        """
+        Polls only the patients whose adaptive next poll time has passed.
+
+        Connections are refreshed every CONNECTIONS_REFRESH seconds (default 900).
+
+        :return: Number of patients polled.
+        """
+        if (self.connections_refreshed_at is None
+                or time.monotonic() - self.connections_refreshed_at >= self.connections_refresh):
+            try:
+                self.refresh_patients()
+            except Exception as e:
+                print("Error fetching connections: ", e)
+
+        now = to_epoch(datetime.now())
+        due = [state for state in self.patients.values() if state.next_poll_at <= now]
+        list(self.executor.map(self.poll_patient, due))
+        return len(due)
+
+    def shutdown(self):
+        """Stops the worker pool, sends queued alerts and closes the API session and database connections."""
+        self.executor.shutdown(wait=True)
+        self.dispatcher.stop()
+        self.session.close()
+        close_connections()
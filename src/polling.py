@@ -0,0 +1,72 @@
+# polling.py
+import os
+
+
+class AdaptivePollPlanner:
+    """
+    Chooses when to poll each patient next from their glucose state.
+
+    Patients outside or near the thresholds, or changing quickly, are polled every
+    min_interval seconds; patients stable in range every max_interval seconds; everyone
+    else every default_interval seconds. Poll times are then moved to just after the
+    sensor's next expected measurement, so the same reading is not fetched twice.
+    """
+
+    def __init__(self, min_interval=None, default_interval=None, max_interval=None,
+                 sensor_period=None, sensor_lag=None, margin=0.5, fast_rate=0.1):
+        """
+        :param min_interval: Seconds between polls for at-risk patients (POLL_MIN_INTERVAL, default 60).
+        :param default_interval: Seconds between polls otherwise (MONITOR_INTERVAL minutes, default 5).
+        :param max_interval: Seconds between polls for stable patients (POLL_MAX_INTERVAL, default 900).
+        :param sensor_period: Seconds between sensor measurements (SENSOR_PERIOD, default 60).
+        :param sensor_lag: Seconds after a measurement before it is available upstream (SENSOR_LAG, default 20).
+        :param margin: Distance in mmol/L from a threshold that counts as near it.
+        :param fast_rate: Rate of change in mmol/L per minute that counts as trending fast.
+        """
+        self.min_interval = min_interval or int(os.getenv("POLL_MIN_INTERVAL", 60))
+        self.default_interval = default_interval or int(os.getenv("MONITOR_INTERVAL", 5)) * 60
+        self.max_interval = max_interval or int(os.getenv("POLL_MAX_INTERVAL", 900))
+        self.sensor_period = sensor_period or int(os.getenv("SENSOR_PERIOD", 60))
+        self.sensor_lag = sensor_lag if sensor_lag is not None else int(os.getenv("SENSOR_LAG", 20))
+        self.margin = margin
+        self.fast_rate = fast_rate
+
+    def interval(self, value, rate, thresholds):
+        """
+        Picks the polling interval for a patient's current state.
+
+        :param value: Latest glucose value in mmol/L.
+        :param rate: Rate of change in mmol/L per minute, or None if unknown.
+        :param thresholds: ThresholdProfile of the patient.
+        :return: Interval in seconds.
+        """
+        near_threshold = not thresholds.low + self.margin <= value <= thresholds.high - self.margin
+        if near_threshold or (rate is not None and abs(rate) >= self.fast_rate):
+            return self.min_interval
+        if rate is not None and abs(rate) < self.fast_rate / 2:
+            return self.max_interval
+        return self.default_interval
+
+    def next_poll(self, measurement_time, value, rate, thresholds, now):
+        """
+        Computes when to poll a patient next.
+
+        :param measurement_time: Epoch time of the latest measurement.
+        :param value: Latest glucose value in mmol/L.
+        :param rate: Rate of change in mmol/L per minute, or None if unknown.
+        :param thresholds: ThresholdProfile of the patient.
+        :param now: Current epoch time, on the same clock as measurement_time.
+        :return: Epoch time of the next poll.
+        """
+        earliest = now + self.interval(value, rate, thresholds)
+
+        # A measurement several periods old means the sensor is not reporting on schedule, and one
+        # from the future means its clock is ahead of ours, so neither can be aligned to
+        if not 0 <= now - measurement_time <= 3 * self.sensor_period + self.sensor_lag:
+            return earliest
+
+        # Round up to the first expected measurement at or after the earliest poll time,
+        # waiting at most one sensor period longer than the interval
+        periods = -(-(earliest - self.sensor_lag - measurement_time) // self.sensor_period)
+        aligned = measurement_time + max(periods, 1) * self.sensor_period + self.sensor_lag
+        return min(aligned, earliest + self.sensor_period)
@@ -2,6 +2,8 @@ import sqlite3
 import os
 from datetime import datetime, timedelta
 import random
+from database import setup_database, rebuild_stats
+from utils import to_epoch
 # Specify the SQLite database file
 DB_FILE = "../data/sample_blood_sugar_data.db"
 
@@ -11,38 +13,15 @@ def create_sample_database():
         os.remove(DB_FILE)
         print(f"Deleted old database: {DB_FILE}")
 
-    # Create a new database connection
+    # Create the tables with the current schema, then open a connection to fill them
+    setup_database(DB_FILE)
     con = sqlite3.connect(DB_FILE)
     cur = con.cursor()
 
-    # Create tables
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS blood_sugar_log (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT NOT NULL,
-        glucose_value REAL NOT NULL,
-        alert_type TEXT,
-        log_type TEXT,
-        notes TEXT
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS insulin_doses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT NOT NULL,
-        dosage_amount REAL NOT NULL,
-        dosage_type TEXT,
-        entry_type TEXT,
-        carbs REAL,
-        related_log_id INTEGER,
-        FOREIGN KEY(related_log_id) REFERENCES blood_sugar_log(id)
-    )
-    """)
-
     # Insert sample data into blood_sugar_log
     start_time = datetime.now() - timedelta(days=7)  # Start from 7 days ago
     # Insert sample data into blood_sugar_log
+    readings = []
     for i in range(50):  # Add 50 entries
         # Generate a random glucose value with some variability
         base_value = random.uniform(4.0, 7.0)  # Normal range as the base
@@ -52,27 +31,35 @@ def create_sample_database():
         # Ensure values stay within a realistic range
         glucose_value = max(2.0, min(glucose_value, 15.0))
 
-        timestamp = (start_time + timedelta(minutes=i * 120)).strftime('%m/%d/%Y %I:%M:%S %p')
+        timestamp = to_epoch(start_time + timedelta(minutes=i * 120))
         alert_type = "High" if glucose_value > 9.0 else "Low" if glucose_value < 3.9 else None
         log_type = "Manual" if i % 2 == 0 else "Automatic"
         notes = "Sample note" if i % 5 == 0 else None
 
-        cur.execute("""
-        INSERT INTO blood_sugar_log (timestamp, glucose_value, alert_type, log_type, notes)
-        VALUES (?, ?, ?, ?, ?)
-        """, (timestamp, glucose_value, alert_type, log_type, notes))
+        readings.append((timestamp, glucose_value, alert_type, log_type, notes))
+
+    cur.executemany("""
+    INSERT INTO blood_sugar_log (timestamp, glucose_value, alert_type, log_type, notes)
+    VALUES (?, ?, ?, ?, ?)
+    """, readings)
 
     # Insert sample data into insulin_doses
+    doses = []
     for i in range(20):  # Add 20 entries
-        timestamp = (start_time + timedelta(minutes=i * 360)).strftime('%m/%d/%Y %I:%M:%S %p')
+        timestamp = to_epoch(start_time + timedelta(minutes=i * 360))
         dosage_amount = round(5 + (i % 5) * 2, 1)
         dosage_type = "Bolus" if i % 2 == 0 else "Basal"
         entry_type = "Manual"
         carbs = round(15 + i * 2, 1)
-        cur.execute("""
-        INSERT INTO insulin_doses (timestamp, dosage_amount, dosage_type, entry_type, carbs)
-        VALUES (?, ?, ?, ?, ?)
-        """, (timestamp, dosage_amount, dosage_type, entry_type, carbs))
+        doses.append((timestamp, dosage_amount, dosage_type, entry_type, carbs))
+
+    cur.executemany("""
+    INSERT INTO insulin_doses (timestamp, dosage_amount, dosage_type, entry_type, carbs)
+    VALUES (?, ?, ?, ?, ?)
+    """, doses)
+
+    # Aggregate the sample readings into the stats tables
+    rebuild_stats(cur)
 
     # Commit changes and close the connection
     con.commit()
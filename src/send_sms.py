@@ -1,35 +1,228 @@
-from twilio.rest import Client
+import os
+import queue
+import threading
+import time
 import keys_example
+from instrumentation import increment, timed
+
+# Twilio's limit for the body of a single (concatenated) message
+MAX_MESSAGE_LENGTH = 1600
+
+
+class TwilioTransport:
+    '''
+    Sends SMS messages through one reused Twilio client.
+    '''
+
+    def __init__(self, account_sid=None, auth_token=None, from_number=None):
+        '''
+        :param account_sid: Twilio account SID, defaults to keys_example.account_sid.
+        :param auth_token: Twilio auth token, defaults to keys_example.auth_token.
+        :param from_number: Twilio number to send from, defaults to keys_example.twilio_number.
+        '''
+        self.account_sid = account_sid or keys_example.account_sid
+        self.auth_token = auth_token or keys_example.auth_token
+        self.from_number = from_number or keys_example.twilio_number
+        self.client = None
+        self.lock = threading.Lock()
+
+    def send(self, to, body):
+        '''
+        Send a message, creating the Twilio client on first use.
+
+        :param to: Recipient phone number.
+        :param body: The text message to send.
+        '''
+        with self.lock:
+            if self.client is None:
+                from twilio.rest import Client
+                self.client = Client(self.account_sid, self.auth_token)
+        self.client.messages.create(body=body, from_=self.from_number, to=to)
+
+
+class StubTransport:
+    '''
+    Records messages locally instead of sending them, for testing.
+    '''
+
+    def __init__(self, failures=0):
+        '''
+        :param failures: Number of send attempts that should fail before messages are accepted.
+        '''
+        self.failures = failures
+        self.sent = []
+
+    def send(self, to, body):
+        '''
+        Record a message.
+
+        :param to: Recipient phone number.
+        :param body: The text message to send.
+        '''
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("Stub transport failure")
+        self.sent.append((to, body))
+        print(f"[stub SMS to {to}]\n{body}")
+
+
+def create_transport():
+    '''
+    Creates the transport selected by the SMS_TRANSPORT environment variable ("twilio" or "stub").
+
+    :return: Transport instance.
+    '''
+    if os.getenv('SMS_TRANSPORT', 'twilio').lower() == 'stub':
+        return StubTransport()
+    return TwilioTransport()
+
+
+class AlertDispatcher:
+    '''
+    Sends alerts from a background queue so monitoring never waits on the SMS API.
+
+    Alerts queued for the same recipient within coalesce_window seconds are joined into
+    one message, and failed sends are retried with exponential backoff.
+    '''
+
+    def __init__(self, transport=None, max_retries=3, backoff=1.0, coalesce_window=2.0):
+        '''
+        :param transport: Transport used to send messages, defaults to create_transport().
+        :param max_retries: Retries after a failed send before the message is dropped.
+        :param backoff: Seconds to wait before the first retry, doubled for each retry.
+        :param coalesce_window: Seconds to collect further alerts before sending.
+        '''
+        self.transport = transport or create_transport()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.coalesce_window = coalesce_window
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def start(self):
+        '''Starts the background worker if it is not running.'''
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+            self.thread.start()
+
+    def submit(self, msg, to=None):
+        '''
+        Queue an alert for sending.
+
+        :param msg: The text message to send.
+        :param to: Recipient phone number, defaults to keys_example.target_number.
+        '''
+        self.start()
+        self.queue.put((to or keys_example.target_number, msg))
+
+    def stop(self):
+        '''Sends every queued alert and stops the worker.'''
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def _run(self):
+        '''Collects alerts, coalesces them per recipient and sends them until stopped.'''
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+
+            # Gather alerts arriving shortly after the first so bursts become one message
+            deadline = time.monotonic() + self.coalesce_window
+            while True:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            for to, bodies in coalesce(batch).items():
+                for body in bodies:
+                    self._send_with_retry(to, body)
+
+    def _send_with_retry(self, to, body):
+        '''
+        Send one message, retrying with exponential backoff.
+
+        :param to: Recipient phone number.
+        :param body: The text message to send.
+        '''
+        for attempt in range(self.max_retries + 1):
+            try:
+                with timed("sms_send"):
+                    self.transport.send(to, body)
+                increment("sms_sent")
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print("Error sending SMS: ", e)
+                    increment("sms_failures")
+                    return
+                time.sleep(self.backoff * 2 ** attempt)
+
+
+def coalesce(batch):
+    '''
+    Joins queued alerts per recipient into as few messages as the length limit allows.
+
+    :param batch: List of (recipient, message) tuples in queue order.
+    :return: Dictionary of recipient to list of message bodies.
+    '''
+    messages = {}
+    for to, msg in batch:
+        bodies = messages.setdefault(to, [])
+        if bodies and len(bodies[-1]) + len(msg) + 2 <= MAX_MESSAGE_LENGTH:
+            bodies[-1] = f"{bodies[-1]}\n\n{msg}"
+        else:
+            bodies.append(msg)
+    return messages
+
+
+# Shared transport and dispatcher, created on first use
+_transport = None
+_dispatcher = None
+_lock = threading.Lock()
+
+
+def get_dispatcher():
+    '''
+    Returns the shared alert dispatcher, creating it on first use.
+
+    :return: AlertDispatcher instance.
+    '''
+    global _dispatcher
+    with _lock:
+        if _dispatcher is None:
+            _dispatcher = AlertDispatcher(get_transport())
+        return _dispatcher
+
+
+def get_transport():
+    '''
+    Returns the shared transport, creating it on first use.
+
+    :return: Transport instance.
+    '''
+    global _transport
+    if _transport is None:
+        _transport = create_transport()
+    return _transport
+
 
 def send_sms(msg):
     '''
-    Send an SMS message using the Twilio API.
+    Send an SMS message immediately using the shared transport.
 
     :param msg: The text message to send
     '''
 
     try:
-<<<<<<< HEAD
-<<<<<<< HEAD
-        client = Client(keys_example.account_sid, keys_example.auth_token)
-        message = client.messages.create(
-            body=msg,
-            from_ = keys_example.twilio_number,
-            to= keys_example.target_number
-=======
-        client = Client(keys.account_sid, keys.auth_token)
-        message = client.messages.create(
-            body=msg,
-            from_ = keys.twilio_number,
-            to= keys.target_number
->>>>>>> 84d5676 (Initial commit for DiaComp project)
-=======
-        client = Client(keys_example.account_sid, keys_example.auth_token)
-        message = client.messages.create(
-            body=msg,
-            from_ = keys_example.twilio_number,
-            to= keys_example.target_number
->>>>>>> ba128ee (Updated files to incorporate example configurations)
-        )
+        get_transport().send(keys_example.target_number, msg)
     except Exception as e:
         print("Error sending SMS: ", e)
@@ -0,0 +1,116 @@
+# trend.py
+from array import array
+
+
+class TrendDetector:
+    """
+    Streaming glucose trend for one patient.
+
+    Keeps the most recent readings in a fixed-size ring buffer together with running sums,
+    so the least-squares slope is updated in O(1) for each new reading without any
+    DataFrame work or database reads.
+    """
+
+    def __init__(self, size=12, min_points=3):
+        """
+        :param size: Number of recent readings used for the trend.
+        :param min_points: Readings needed before a trend is reported.
+        """
+        self.size = size
+        self.min_points = min_points
+        self.times = array('d', [0.0] * size)  # Minutes since self.origin
+        self.values = array('d', [0.0] * size)
+        self.count = 0
+        self.next_index = 0
+        self.pushes = 0
+        self.origin = None
+        self.last_timestamp = None
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+
+    def add(self, timestamp, value):
+        """
+        Adds a reading, ignoring readings that are not newer than the latest one.
+
+        :param timestamp: Reading time in epoch seconds.
+        :param value: Glucose value in mmol/L.
+        :return: True if the reading was added.
+        """
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            return False
+        if self.origin is None:
+            self.origin = timestamp
+        self.last_timestamp = timestamp
+        t = (timestamp - self.origin) / 60.0
+
+        if self.count == self.size:
+            old_t = self.times[self.next_index]
+            old_v = self.values[self.next_index]
+            self.sum_t -= old_t
+            self.sum_v -= old_v
+            self.sum_tt -= old_t * old_t
+            self.sum_tv -= old_t * old_v
+        else:
+            self.count += 1
+
+        self.times[self.next_index] = t
+        self.values[self.next_index] = value
+        self.sum_t += t
+        self.sum_v += value
+        self.sum_tt += t * t
+        self.sum_tv += t * value
+        self.next_index = (self.next_index + 1) % self.size
+
+        # Once per full turn of the buffer, rebase times on the oldest reading and recompute
+        # the sums, which keeps rounding error bounded at amortised O(1) cost
+        self.pushes += 1
+        if self.pushes % self.size == 0:
+            self._rebase()
+        return True
+
+    def _rebase(self):
+        """Shifts times so the oldest reading is at zero and recomputes the running sums."""
+        indexes = [(self.next_index + i) % self.size for i in range(self.size - self.count, self.size)]
+        shift = self.times[indexes[0]]
+        self.origin += shift * 60.0
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_tv = 0.0
+        for i in indexes:
+            t = self.times[i] - shift
+            self.times[i] = t
+            self.sum_t += t
+            self.sum_v += self.values[i]
+            self.sum_tt += t * t
+            self.sum_tv += t * self.values[i]
+
+    @property
+    def latest_value(self):
+        """Most recent glucose value, or None if no readings were added."""
+        if self.count == 0:
+            return None
+        return self.values[(self.next_index - 1) % self.size]
+
+    def rate_of_change(self):
+        """
+        Least-squares slope of the buffered readings.
+
+        :return: Rate of change in mmol/L per minute, or None with too few readings.
+        """
+        if self.count < self.min_points:
+            return None
+        denominator = self.count * self.sum_tt - self.sum_t * self.sum_t
+        if denominator <= 0:
+            return None
+        return (self.count * self.sum_tv - self.sum_t * self.sum_v) / denominator
+
+    def minutes_until_below(self, threshold):
+        """
+        Projects when glucose will fall below a threshold at the current rate of change.
+
+        :param threshold: Glucose threshold in mmol/L.
+        :return: Minutes until the threshold is crossed, or None if glucose is not falling
+                 towards it or is already below it.
+        """
+        slope = self.rate_of_change()
+        latest_value = self.latest_value
+        if slope is None or slope >= 0 or latest_value < threshold:
+            return None
+        return (latest_value - threshold) / -slope
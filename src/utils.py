@@ -1,6 +1,74 @@
 
 from datetime import datetime, timedelta
 
+# Timestamps are stored as integer seconds of local wall-clock time since 1970-01-01,
+# matching the naive local times reported by the sensor.
+EPOCH = datetime(1970, 1, 1)
+
+# Text formats found in older databases and user input
+TIMESTAMP_FORMATS = ('%m/%d/%Y %I:%M:%S %p', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S',
+                     '%Y-%m-%d')
+
+
+def parse_timestamp(value):
+    '''
+    Parses a timestamp string in any of the supported text formats.
+
+    :param value: Timestamp string (e.g., '12/15/2024 7:28:23 PM' or '2024-12-15 19:28:23').
+    :return: Naive datetime.
+    :raises ValueError: If the string matches none of the supported formats.
+    '''
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), timestamp_format)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized timestamp format: '{value}'")
+
+
+def to_epoch(value):
+    '''
+    Converts a timestamp to the integer epoch seconds stored in the database.
+
+    :param value: datetime, timestamp string or epoch seconds.
+    :return: Epoch seconds as an integer.
+    '''
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = parse_timestamp(value)
+    return int((value.replace(tzinfo=None) - EPOCH).total_seconds())
+
+
+def from_epoch(seconds):
+    '''
+    Converts stored epoch seconds back to a naive local datetime.
+
+    :param seconds: Epoch seconds.
+    :return: Naive datetime.
+    '''
+    return EPOCH + timedelta(seconds=int(seconds))
+
+
+def resolve_time_range(start=None, end=None, days=None):
+    '''
+    Resolves a time range from optional start and end times and a number of days.
+
+    :param start: Earliest time (datetime or timestamp string), or None.
+    :param end: Latest time, or None for now.
+    :param days: Days before end to start from when start is not given.
+    :return: Tuple of (start, end) datetimes; start is None for no lower bound.
+    '''
+    end = parse_timestamp(end) if isinstance(end, str) else end or datetime.now()
+    if isinstance(start, str):
+        start = parse_timestamp(start)
+    elif start is None and days is not None:
+        start = end - timedelta(days=days)
+    if start is not None and start > end:
+        raise ValueError(f"Start {start} is after end {end}.")
+    return start, end
+
+
 def get_time_filter():
 
     while True:
@@ -25,29 +93,3 @@ def get_time_filter():
         return curr_time - timedelta(days=30)
     elif time_filter == 5:
         return curr_time - timedelta(days=60)
-
-
-def filter_blood_sugar_data(data):
-    '''
-    Filters blood sugar data based on a time range given by the user.
-    :param data: Blood sugar data table
-    :return: Filtered data table
-    '''
-
-    try:
-        start_date = get_time_filter()
-        end_date = datetime.now()
-
-        filtered_data = data[
-            (data['timestamp'] >= start_date) &
-            (data['timestamp'] <= end_date)
-            ]
-
-
-        if filtered_data.empty:
-            print("No blood sugar data available for the selected time range.")
-            return None
-        return filtered_data
-    except Exception as e:
-        print("Error filtering blood sugar data: ", e)
-        return None